@@ -2,6 +2,7 @@
 
 import numpy as np
 import random
+from .instrumentation import get_instrumentation, timed
 
 
 def error(product, matrix):
@@ -86,6 +87,7 @@ def iteration(product,mx,s):
         mret = [True, matrix1]
     return mret
 
+@timed("allocation_matrix.resolve_allocation_matrix")
 def resolve_allocation_matrix(sources,product,matrix,maxiterations=1e4):
 
     """
@@ -138,6 +140,7 @@ def resolve_allocation_matrix(sources,product,matrix,maxiterations=1e4):
         for s in range(len(sources)):
             err = err + matrix[s][p]
         err = product[p]-err
+    get_instrumentation().count("allocation_matrix.iterations", i)
     return matrix,curr_error
 
 
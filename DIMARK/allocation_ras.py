@@ -9,7 +9,9 @@ Faculty of Economic Sciences and Management
 
 """
 import numpy as np
+from .instrumentation import get_instrumentation, timed
 
+@timed("allocation_ras.ras_method")
 def ras_method(products, sources, initialA = [], tol=1e-5, max_iter=10000):
     """
     Rekonstruuje macierz na podstawie zadanych sum wierszy i kolumn za pomocą metody RAS.
@@ -28,7 +30,9 @@ def ras_method(products, sources, initialA = [], tol=1e-5, max_iter=10000):
         A = np.ones((m, n))  # Początkowa macierz z wartościami równymi 1
     else:
         A = initialA
+    iterations = 0
     for iteration in range(max_iter):
+        iterations += 1
         # Skaluje wiersze
         for i in range(m):
             row_sum = np.sum(A[i, :])
@@ -47,7 +51,9 @@ def ras_method(products, sources, initialA = [], tol=1e-5, max_iter=10000):
         if np.allclose(row_sum_check, products, atol=tol) and np.allclose(col_sum_check, sources, atol=tol):
             break
     else:
-        print("Ostrzeżenie: Metoda RAS nie osiągnęła zbieżności w zadanej liczbie iteracji.")
+        # Brak zbieżności w zadanej liczbie iteracji
+        get_instrumentation().event("allocation_ras.not_converged", max_iter=max_iter)
+    get_instrumentation().count("allocation_ras.iterations", iterations)
 
     return A
 
@@ -2,10 +2,39 @@
 
 # The functions in this file require source data obtained from the Forest Data Bank (Bank Danych o Lasach), accessible at www.bdl.lasy.gov.pl. The data can be downloaded through the form available on the website https://www.bdl.lasy.gov.pl/portal/wniosek. For the selected year, data for the chosen set of forest districts should be downloaded and extracted into a single directory, resulting in approximately 400 folders for the entire country, such as ["BDL_01_01_AUGUSTOW_2022", "BDL_01_02_BIALOWIEZA_2022", ...]. It is imperative that the structure of the files within the folders downloaded from the data bank remains unaltered.
 
+# pandas is imported inside the functions that read BDL files, so that the projection
+# functions can be used without loading it. Read times, progress and diagnostics are reported
+# to the active instrumentation (see instrumentation.py).
+
 import numpy as np
-import pandas as pd
 import os
-from tqdm import tqdm
+from .instrumentation import get_instrumentation, timed
+
+# Function that reads the subarea and storey tables of a forest district, reporting read metrics
+def read_district(folderBDL, folder=""):
+    """
+    Reads the f_subarea.txt and f_storey_species.txt tables of a forest district.
+
+    :param folderBDL: Name of the folder with BDL data (str)
+    :param folder: Directory containing the BDL folders (str)
+    :return: Two DataFrames: the subarea table and the storey species table (pd.DataFrame, pd.DataFrame)
+    """
+    import pandas as pd
+
+    inst = get_instrumentation()
+    subarea_path = folder + "/" + folderBDL + "/f_subarea.txt"
+    storey_path = folder + "/" + folderBDL + "/f_storey_species.txt"
+    with inst.timer("bdl.read_district") as timer:
+        bdl_subarea = pd.read_csv(subarea_path, sep='\t')
+        bdl_storey = pd.read_csv(storey_path, sep='\t')
+    rows = len(bdl_subarea) + len(bdl_storey)
+    nbytes = os.path.getsize(subarea_path) + os.path.getsize(storey_path)
+    inst.count("bdl.districts_read")
+    inst.count("bdl.rows_parsed", rows)
+    inst.count("bdl.bytes_read", nbytes)
+    if hasattr(timer, "seconds"):
+        inst.event("bdl.district_read", district=folderBDL, seconds=timer.seconds, rows=rows, bytes=nbytes)
+    return bdl_subarea, bdl_storey
 
 # Function that returns the area of cultivation of a species within the age range in a given forest district as an array of length 200.
 def cultivation_areaf(species, agemin, agemax, folderBDL, folder=""):
@@ -19,8 +48,9 @@ def cultivation_areaf(species, agemin, agemax, folderBDL, folder=""):
     :param folderBDL: Name of the folder with BDL data (str)
     :return: Array of length 200 with the cultivation area within the specified age range (np.ndarray)
     """
-    bdl_subarea = pd.read_csv(folder + "/" + folderBDL + "/f_subarea.txt", sep='\t')
-    bdl_storey = pd.read_csv(folder + "/" + folderBDL + "/f_storey_species.txt", sep='\t')
+    import pandas as pd
+
+    bdl_subarea, bdl_storey = read_district(folderBDL, folder)
     area = bdl_subarea.set_index('arodes_int_num')['sub_area'].to_dict()
     bdl_storey = bdl_storey.fillna(0)
     df = bdl_storey[
@@ -48,8 +78,7 @@ def cultivation_volumef(species, agemin, agemax, folderBDL, folder=""):
     :param folderBDL: Name of the folder with BDL data (str)
     :return: Array of length 200 with the cultivation area within the specified age range (np.ndarray)
     """
-    bdl_subarea = pd.read_csv(folder + "/" + folderBDL + "/f_subarea.txt", sep='\t')
-    bdl_storey = pd.read_csv(folder + "/" + folderBDL + "/f_storey_species.txt", sep='\t')
+    bdl_subarea, bdl_storey = read_district(folderBDL, folder)
 #    area = bdl_subarea.set_index('arodes_int_num')['sub_area'].to_dict()
     bdl_storey = bdl_storey.fillna(0)
     df = bdl_storey[
@@ -98,7 +127,7 @@ def cultivation_area(species, agemin, agemax, folder=""):
     """
     flist = list_directories(folder +"/")
     y = cultivation_areaf(species, agemin, agemax, flist[0], folder)
-    for f in tqdm(flist[1:], desc="Progress", unit="dir", ncols=100):
+    for f in get_instrumentation().progress(flist[1:], desc="Progress", total=len(flist) - 1):
         x = cultivation_areaf(species, agemin, agemax, f, folder)
         for i in range(len(y)):
             y[i] += x[i]
@@ -120,7 +149,7 @@ def cultivation_volume(species, agemin, agemax, folder=""):
     n = len(flist)
     y = cultivation_areaf(species, agemin, agemax, flist[0], folder)
     n0 = np.zeros(200)
-    for f in tqdm(flist[1:], desc="Progress", unit="dir", ncols=100):
+    for f in get_instrumentation().progress(flist[1:], desc="Progress", total=len(flist) - 1):
         x = cultivation_volumef(species, agemin, agemax, f, folder)
         
         for i in range(len(y)):
@@ -212,7 +241,7 @@ def harvest_probability(a, yearmin=90, yearmax=120, av=1, transmission=0.01):
         if h[y] > 0:
             not0 = not0 + 1
         h_trans = h_trans * (1. - h[y])
-    print(transmission, h_trans, not0)
+    get_instrumentation().event("bdl.harvest_probability", transmission=transmission, h_trans=h_trans, nonzero=not0)
     k = np.power(transmission / h_trans, 1.)    
     for y in range(len(a)):
         s[y] = s[y] * k
@@ -235,6 +264,7 @@ def harvest_area(a, h_prob):
     return sum(a * h_prob)
 
 # Function that allows calculating the distribution of cultivation areas at an earlier time based on the distribution of areas by age
+@timed("bdl.harvest_area_past")
 def harvest_area_past(area, harvest_age_min, harvest_age_max, timeback_projection, curr_year=2022):
     """
     Calculates the area available for harvesting in the past, taking into account projected historical data
@@ -258,7 +288,7 @@ def harvest_area_past(area, harvest_age_min, harvest_age_max, timeback_projectio
     beforeH = area[harvest_age_min - 5:harvest_age_min].mean()
     afterH = area[harvest_age_max:harvest_age_max + 5].mean()
     percent = afterH / beforeH
-    print("percent", percent)
+    get_instrumentation().event("bdl.harvest_area_past", percent=percent)
     hp = harvest_probability(area, harvest_age_min, harvest_age_max, 5, percent)  # Calculate the distribution of harvesting probability
     retY = []
     retHVA = []
@@ -275,6 +305,7 @@ def harvest_area_past(area, harvest_age_min, harvest_age_max, timeback_projectio
     return retY, retHVA
 
 # Function that allows predicting the distribution of cultivation areas by age in the future based on the current distribution
+@timed("bdl.age_area_prediction")
 def age_area_prediction(a, harvest_age_min, harvest_age_max, years=100):
     """
     Allows predicting the distribution of cultivation areas by age in the future based on the current distribution
@@ -303,6 +334,7 @@ def age_area_prediction(a, harvest_age_min, harvest_age_max, years=100):
     return setA
 
 # Function that allows predicting the harvesting area based on the age distribution of cultivation areas
+@timed("bdl.harvest_area_prediction")
 def harvest_area_prediction(area, harvest_age_min, harvest_age_max, time_projection, curr_year=2022):
     """
     Allows predicting the harvesting area based on the age distribution of cultivation areas.
@@ -321,3 +353,270 @@ def harvest_area_prediction(area, harvest_age_min, harvest_age_max, time_project
         retY.append(y + curr_year)
         retHVA.append(sum(age_area[y][harvest_age_min: harvest_age_max]))
     return retY, retHVA
+
+
+# Pure variants of the projection functions. They return the same values as the functions above
+# but never modify their arguments, never report to stdout or to the instrumentation and keep no
+# shared state. Inputs are only read, so read-only arrays (e.g. np.ndarray views of a
+# multiprocessing.shared_memory block holding the national age distribution) can be passed to
+# many threads or processes running scenario sweeps without defensive copies.
+
+# Function that returns the distribution of harvesting without side effects
+def harvest_probability_pure(a, yearmin=90, yearmax=120, av=1, transmission=0.01):
+    """
+    Pure, vectorized variant of `harvest_probability`.
+
+    :param a: Array of cultivation areas (np.ndarray), only read
+    :param yearmin: Minimum tree age for harvesting (int)
+    :param yearmax: Maximum tree age for harvesting (int)
+    :param av: Window size for smoothing the data (int)
+    :param transmission: Transmission factor for adjusting the harvesting probability (float)
+    :return: New array with the distribution of harvesting probability (np.ndarray)
+    """
+    a = np.asarray(a, dtype=float)
+    n = len(a)
+    h = np.zeros(200)
+    h[yearmin:yearmax] = np.maximum(a[yearmin - 1:yearmax - 1] - a[yearmin:yearmax], 0.)
+    h[yearmin:yearmax] /= h.sum()
+
+    if av > 1:
+        h = smooth_data(h, av)
+        h_sum = h.sum()
+        if h_sum < 0.99:
+            h[yearmin:yearmax] /= h_sum
+
+    h_trans = np.prod(1. - h[:n])
+    s = (1. - h[:n]) * (transmission / h_trans)
+    following = np.append(h, 0.)[1:n + 1]
+    last = (h[:n] > 0) & (following == 0)
+    h[:n][last] = 1.0 - s[last]
+    return h
+
+# Function that projects the harvesting area into the past without modifying the age distribution
+def harvest_area_past_pure(area, harvest_age_min, harvest_age_max, timeback_projection, curr_year=2022):
+    """
+    Pure variant of `harvest_area_past`: the caller's `area` is not modified.
+
+    :param area: Array of cultivation areas (np.ndarray), only read
+    :param harvest_age_min: Minimum tree age for harvesting (int)
+    :param harvest_age_max: Maximum tree age for harvesting (int)
+    :param timeback_projection: Number of years for the backward projection (int)
+    :param curr_year: Current year from which the projection starts (int, default is 2022)
+    :return: Two arrays: years and corresponding areas available for harvesting in those years (np.ndarray, np.ndarray)
+    """
+    area = np.asarray(area, dtype=float)
+    treshold = area[10:30].mean()  # Set threshold based on the average area in the range 10-30 years
+    z2 = np.where((area > treshold) | (np.arange(len(area)) > 20), area, treshold)
+    beforeH = z2[harvest_age_min - 5:harvest_age_min].mean()
+    afterH = z2[harvest_age_max:harvest_age_max + 5].mean()
+    hp = harvest_probability_pure(z2, harvest_age_min, harvest_age_max, 5, afterH / beforeH)[:len(z2) - 1]
+    retHVA = np.empty(max(timeback_projection - 1, 0))
+    for dyear in range(timeback_projection):
+        harvested = z2[0]
+        z2[:-1] = z2[1:] + hp * harvested
+        if dyear > 0:
+            retHVA[dyear - 1] = z2[harvest_age_min:harvest_age_max].sum()
+    retY = curr_year - np.arange(1, timeback_projection)
+    return retY, retHVA
+
+# Function that predicts the distribution of cultivation areas by age without side effects
+def age_area_prediction_pure(a, harvest_age_min, harvest_age_max, years=100, dtype=np.float64):
+    """
+    Pure, vectorized variant of `age_area_prediction`.
+
+    With dtype=np.float32 the returned array is stored in single precision while every year is
+    still computed in float64 (the replanted area is a float64 dot product). The stored areas are
+    rounded once per year, so their relative error is at most (years + 1) * 2**-24 (6.1e-6 after
+    100 years) of the float64 result.
+
+    :param a: Array of current cultivation areas by tree age (np.ndarray), only read
+    :param harvest_age_min: Minimum tree age for harvesting (int)
+    :param harvest_age_max: Maximum tree age for harvesting (int)
+    :param years: Number of years for the prediction (int, default is 100)
+    :param dtype: Precision of the returned array (np.dtype, default is float64)
+    :return: Array of shape (years + 1, ages) with the distribution of cultivation areas for subsequent years (np.ndarray)
+    """
+    a = np.asarray(a, dtype=float)
+    n = len(a)
+    beforeH = a[harvest_age_min - 5:harvest_age_min].mean()
+    afterH = a[harvest_age_max:harvest_age_max + 5].mean()
+    hp = harvest_probability_pure(a, harvest_age_min, harvest_age_max, 5, afterH / beforeH)[:n]
+    survival = np.maximum(0., 1. - hp[1:])
+    setA = np.empty((years + 1, n), dtype=dtype)
+    setA[0] = a
+    for y in range(years):
+        current = np.asarray(setA[y], dtype=float)
+        setA[y + 1, 1:] = current[:-1] * survival
+        setA[y + 1, 0] = np.dot(hp, current)
+    return setA
+
+# Function that predicts the harvesting area without side effects
+def harvest_area_prediction_pure(area, harvest_age_min, harvest_age_max, time_projection, curr_year=2022,
+                                 dtype=np.float64):
+    """
+    Pure variant of `harvest_area_prediction`.
+
+    :param area: Array of cultivation areas (np.ndarray), only read
+    :param harvest_age_min: Minimum tree age for harvesting (int)
+    :param harvest_age_max: Maximum tree age for harvesting (int)
+    :param time_projection: Number of years for the prediction (int)
+    :param curr_year: Current year from which the prediction starts (int, default is 2022)
+    :param dtype: Precision of the age structure projection, see `age_area_prediction_pure`;
+                  the harvesting areas are summed in float64 (np.dtype, default is float64)
+    :return: Two arrays: years and corresponding harvesting areas in those years (np.ndarray, np.ndarray)
+    """
+    age_area = age_area_prediction_pure(area, harvest_age_min, harvest_age_max, time_projection, dtype)
+    retY = curr_year + np.arange(time_projection)
+    retHVA = age_area[:time_projection, harvest_age_min:harvest_age_max].sum(axis=1, dtype=np.float64)
+    return retY, retHVA
+
+
+# Batched variants used to calibrate the harvesting parameters. Every row of the results belongs
+# to one candidate (harvest_age_min, harvest_age_max, av, transmission); the intermediate results
+# that do not depend on the candidate are computed once.
+
+# Function that smooths every row of a 2D array with the moving average of smooth_data
+def _smooth_rows(data, window_size):
+    cumsum = np.cumsum(data, axis=1)
+    smoothed = np.empty_like(cumsum)
+    head = min(window_size - 1, data.shape[1])
+    smoothed[:, :head] = cumsum[:, :head] / np.arange(1, head + 1)
+    smoothed[:, head:] = cumsum[:, head:]
+    smoothed[:, window_size:] -= cumsum[:, :-window_size]
+    smoothed[:, head:] /= window_size
+    return smoothed
+
+# Function that returns the distributions of harvesting of many candidate parameter sets
+def harvest_probability_batch(a, yearmin, yearmax, av=1, transmission=0.01):
+    """
+    Batched variant of `harvest_probability_pure` for arrays of candidate parameters.
+
+    :param a: Array of cultivation areas (np.ndarray), only read
+    :param yearmin: Minimum tree ages for harvesting (array of int)
+    :param yearmax: Maximum tree ages for harvesting (array of int)
+    :param av: Window sizes for smoothing the data (array of int)
+    :param transmission: Transmission factors (array of float)
+    :return: Array of shape (candidates, 200) with the distributions of harvesting probability (np.ndarray)
+    """
+    a = np.asarray(a, dtype=float)
+    n = len(a)
+    yearmin, yearmax, av, transmission = [np.atleast_1d(v) for v in
+                                          np.broadcast_arrays(yearmin, yearmax, av, transmission)]
+    ages = np.arange(200)
+    in_range = (ages >= yearmin[:, None]) & (ages < yearmax[:, None])
+    decline = np.zeros(200)
+    decline[1:n] = np.maximum(a[:-1] - a[1:], 0.)
+    h = np.where(in_range, decline, 0.)
+    h /= h.sum(axis=1, keepdims=True)
+
+    for w in np.unique(av[av > 1]):
+        rows = av == w
+        hw = _smooth_rows(h[rows], int(w))
+        h_sum = hw.sum(axis=1, keepdims=True)
+        hw = np.where(in_range[rows] & (h_sum < 0.99), hw / h_sum, hw)
+        h[rows] = hw
+
+    h_trans = np.prod(1. - h[:, :n], axis=1)
+    s = (1. - h[:, :n]) * (transmission / h_trans)[:, None]
+    following = np.concatenate([h[:, 1:n + 1], np.zeros((len(h), n + 1 - min(n + 1, 200)))], axis=1)
+    last = (h[:, :n] > 0) & (following == 0)
+    h[:, :n] = np.where(last, 1.0 - s, h[:, :n])
+    return h
+
+# Function that projects the harvesting area into the past for many candidate parameter sets
+def harvest_area_past_batch(area, harvest_age_min, harvest_age_max, timeback_projection, av=5, transmission=None):
+    """
+    Batched variant of `harvest_area_past_pure` for arrays of candidate parameters.
+
+    :param area: Array of cultivation areas (np.ndarray), only read
+    :param harvest_age_min: Minimum tree ages for harvesting (array of int)
+    :param harvest_age_max: Maximum tree ages for harvesting (array of int)
+    :param timeback_projection: Number of years for the backward projection (int)
+    :param av: Window sizes for smoothing the harvesting distribution (array of int, default is 5 as in harvest_area_past)
+    :param transmission: Transmission factors (array of float); nan or None derives them from the area
+                         around the harvesting ages as in harvest_area_past, which needs the five ages
+                         before harvest_age_min and after harvest_age_max
+    :return: Array of shape (candidates, timeback_projection - 1) with the areas available for harvesting
+             in the years curr_year - 1, curr_year - 2, ... (np.ndarray); nan for the candidates whose
+             transmission is derived but harvest_age_min < 5 or harvest_age_max + 5 > len(area)
+    """
+    area = np.asarray(area, dtype=float)
+    n = len(area)
+    treshold = area[10:30].mean()
+    z2 = np.where((area > treshold) | (np.arange(n) > 20), area, treshold)
+    transmission = np.nan if transmission is None else transmission
+    hmin, hmax, av, transmission = [np.atleast_1d(v) for v in
+                                    np.broadcast_arrays(harvest_age_min, harvest_age_max, av,
+                                                        np.asarray(transmission, dtype=float))]
+
+    # Transmission derived from the area before and after the harvesting ages
+    derived = np.isnan(transmission)
+    outside = derived & ((hmin < 5) | (hmax + 5 > n))
+    cumsum = np.concatenate([[0.], np.cumsum(z2)])
+    lo, hi = np.clip(hmin, 5, n), np.clip(hmax, 0, n - 5)
+    beforeH = (cumsum[lo] - cumsum[lo - 5]) / 5.
+    afterH = (cumsum[hi + 5] - cumsum[hi]) / 5.
+    transmission = np.where(derived, afterH / beforeH, transmission)
+
+    hp = harvest_probability_batch(z2, hmin, hmax, av, transmission)[:, :n - 1]
+    ages = np.arange(n)
+    in_range = (ages >= hmin[:, None]) & (ages < hmax[:, None])
+    z = np.repeat(z2[None, :], len(hp), axis=0)
+    retHVA = np.empty((len(hp), max(timeback_projection - 1, 0)))
+    for dyear in range(timeback_projection):
+        harvested = z[:, :1].copy()
+        z[:, :-1] = z[:, 1:] + hp * harvested
+        if dyear > 0:
+            retHVA[:, dyear - 1] = np.sum(z * in_range, axis=1)
+    retHVA[outside] = np.nan
+    return retHVA
+
+# Function that fits the harvesting parameters to an observed series of harvested areas
+def calibrate_harvest_ages(area, observed_years, observed, harvest_age_min, harvest_age_max, av=(5,),
+                           transmission=(None,), curr_year=2022, chunk_size=4096):
+    """
+    Fits the harvesting ages, smoothing window and transmission of `harvest_area_past` to observed data.
+
+    :param area: Array of current cultivation areas by tree age (np.ndarray), only read
+    :param observed_years: Years of the observations, all before curr_year (array of int)
+    :param observed: Observed areas available for harvesting in those years (array of float)
+    :param harvest_age_min: Candidate minimum harvesting ages (iterable of int)
+    :param harvest_age_max: Candidate maximum harvesting ages (iterable of int)
+    :param av: Candidate smoothing windows (iterable of int, default is (5,) as in harvest_area_past)
+    :param transmission: Candidate transmission factors (iterable of float); None derives the factor
+                         from the area as in harvest_area_past (default is (None,))
+    :param curr_year: Year of the age distribution (int, default is 2022)
+    :param chunk_size: Number of candidates backcast at once (int)
+    :return: Two values: the best fit as a dict with keys harvest_age_min, harvest_age_max, av,
+             transmission and rmse, and the RMSE surface of shape (len(harvest_age_min), len(harvest_age_max),
+             len(av), len(transmission)), nan where harvest_age_min >= harvest_age_max or, for a derived
+             transmission, where harvest_age_min < 5 or harvest_age_max + 5 > len(area) (dict, np.ndarray)
+    """
+    observed_years = np.asarray(observed_years, dtype=int)
+    observed = np.asarray(observed, dtype=float)
+    if np.any(observed_years >= curr_year):
+        raise ValueError("Observed years must precede curr_year.")
+    index = curr_year - 1 - observed_years
+    timeback = int(index.max()) + 2
+
+    grids = [np.asarray(harvest_age_min), np.asarray(harvest_age_max), np.asarray(av),
+             np.array([np.nan if t is None else t for t in transmission], dtype=float)]
+    candidates = [g.ravel() for g in np.meshgrid(*grids, indexing="ij")]
+    outside = np.isnan(candidates[3]) & ((candidates[0] < 5) | (candidates[1] + 5 > len(area)))
+    valid = np.flatnonzero((candidates[0] < candidates[1]) & ~outside)
+    rmse = np.full(len(candidates[0]), np.nan)
+    for start in range(0, len(valid), chunk_size):
+        c = valid[start:start + chunk_size]
+        backcast = harvest_area_past_batch(area, candidates[0][c], candidates[1][c], timeback,
+                                           candidates[2][c], candidates[3][c])
+        rmse[c] = np.sqrt(np.mean((backcast[:, index] - observed)**2, axis=1))
+
+    surface = rmse.reshape([len(g) for g in grids])
+    if np.all(np.isnan(rmse)):
+        raise ValueError("No valid candidate: harvest_age_min must be below harvest_age_max, and at least 5 "
+                         "ages must precede harvest_age_min and follow harvest_age_max to derive the transmission.")
+    best = np.nanargmin(rmse)
+    t = candidates[3][best]
+    return {"harvest_age_min": int(candidates[0][best]), "harvest_age_max": int(candidates[1][best]),
+            "av": int(candidates[2][best]), "transmission": None if np.isnan(t) else float(t),
+            "rmse": float(rmse[best])}, surface
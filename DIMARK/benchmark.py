@@ -0,0 +1,330 @@
+# DIMARK/benchmark.py
+
+# Benchmarks of the DIMARK package, runnable offline as
+#     python -m DIMARK.benchmark imports
+#     python -m DIMARK.benchmark run [cases] [--scale 0.1] [--save baseline.json] [--compare baseline.json]
+# Import times are measured in a fresh interpreter, so that the modules already loaded by the
+# caller do not hide the cost of importing a DIMARK module. The hot-path suite runs on synthetic
+# data of realistic size (about 400 districts, 200 ages, 30 species, 100-year horizons and 50x50
+# allocation tables) and records the best wall time and the peak traced memory of every case.
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+MODULES = ["allocation_matrix", "allocation_ras", "bdl", "climate", "instrumentation", "intertemporal",
+           "market", "mathematics", "pipeline", "simulation", "stands", "statistics", "synthetic"]
+
+HEAVY_DEPENDENCIES = ["pandas", "statsmodels", "scipy", "tqdm"]
+
+_IMPORT_SCRIPT = """
+import sys, time
+t = time.perf_counter()
+import DIMARK.{module}
+t = time.perf_counter() - t
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(t, ",".join(heavy))
+"""
+
+
+def import_time(module, repeat=5):
+    """
+    Measures the time of importing a DIMARK module in a fresh interpreter.
+
+    Parameters:
+    module (str): Name of the module within the package, e.g. "intertemporal".
+    repeat (int): Number of fresh interpreters; the fastest import is reported.
+
+    Returns:
+    tuple: Best import time in seconds and the list of heavy dependencies loaded by the import.
+    """
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+    script = _IMPORT_SCRIPT.format(module=module, heavy=HEAVY_DEPENDENCIES)
+    best = None
+    heavy = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True,
+                             text=True, check=True).stdout.split()
+        t = float(out[0])
+        heavy = out[1].split(",") if len(out) > 1 else []
+        best = t if best is None else min(best, t)
+    return best, heavy
+
+
+def import_times(modules=MODULES, repeat=5):
+    """
+    Measures the import time of several DIMARK modules.
+
+    Parameters:
+    modules (list of str): Names of the modules within the package.
+    repeat (int): Number of fresh interpreters per module.
+
+    Returns:
+    dict: Mapping of module name to (best import time in seconds, heavy dependencies loaded).
+    """
+    return {m: import_time(m, repeat) for m in modules}
+
+
+# Hot-path cases: name -> setup(scale, workdir) returning a function without arguments to be timed
+CASES = {}
+
+
+def case(name):
+    """Registers a benchmark case setup under the given name."""
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def _scaled(n, scale, minimum=1):
+    return max(minimum, int(round(n * scale)))
+
+
+def _age_distribution(rng, ages=200):
+    """Realistic area by age: even-aged classes up to the rotation age and a thin tail of old stands."""
+    age = np.arange(ages)
+    area = np.where(age < 110, 1. + 0.3 * np.sin(age / 7.), 0.2 * np.exp(-(age - 110) / 15.))
+    return area * rng.uniform(0.8, 1.2, ages) * 1e3
+
+
+@case("bdl.cultivation_area")
+def _setup_cultivation_area(scale, workdir):
+    from . import bdl
+    from .synthetic import generate_bdl
+    folder = os.path.join(workdir, "bdl")
+    if not os.path.isdir(folder):
+        generate_bdl(folder, _scaled(400, scale), 2000)
+    return lambda: bdl.cultivation_area("SO", 1, 200, folder)
+
+
+@case("bdl.age_area_prediction")
+def _setup_age_area_prediction(scale, workdir):
+    from . import bdl
+    area = _age_distribution(np.random.default_rng(0))
+    years = _scaled(100, scale)
+    return lambda: bdl.age_area_prediction(area, 90, 120, years)
+
+
+@case("intertemporal.area_prediction")
+def _setup_area_prediction(scale, workdir):
+    from . import intertemporal
+    rng = np.random.default_rng(0)
+    species, years = _scaled(30, scale), _scaled(100, scale)
+    area = [list(_age_distribution(rng)) for _ in range(species)]
+    h = [[0.] * 90 + [0.03] * 110 for _ in range(species)]
+    harvest = [h] * years
+    return lambda: intertemporal.area_prediction(area, harvest, years)
+
+
+def _setup_area_prediction_batch(dtype):
+    """Scenario grid of 20 scenarios x 100 years x 30 species x 200 ages, stored with the given dtype."""
+    def setup(scale, workdir):
+        from . import intertemporal
+        rng = np.random.default_rng(0)
+        scenarios, species, years = _scaled(20, scale), _scaled(30, scale), _scaled(100, scale)
+        area = np.stack([_age_distribution(rng) for _ in range(scenarios * species)]).reshape(scenarios, species, -1)
+        harvest = np.broadcast_to(np.where(np.arange(area.shape[-1]) < 90, 0., 0.03), (years,) + area.shape[-2:])
+        return lambda: intertemporal.area_prediction_batch(area, harvest, years, dtype)
+    return setup
+
+
+case("intertemporal.area_prediction_batch")(_setup_area_prediction_batch(np.float64))
+case("intertemporal.area_prediction_batch[float32]")(_setup_area_prediction_batch(np.float32))
+
+
+def _setup_simulate_forest_market(dtype):
+    """The scenario grid of `_setup_area_prediction_batch` coupled with a pooled market, stored with the given dtype."""
+    def setup(scale, workdir):
+        from . import simulation
+        rng = np.random.default_rng(0)
+        scenarios, species, years = _scaled(20, scale), _scaled(30, scale), _scaled(100, scale)
+        area = np.stack([_age_distribution(rng) for _ in range(scenarios * species)]).reshape(scenarios, species, -1)
+        harvest = np.broadcast_to(np.where(np.arange(area.shape[-1]) < 90, 0., 0.03), (years,) + area.shape[-2:])
+        density = 450. * (1. - np.exp(-0.025 * np.arange(area.shape[-1]))) ** 2.5
+        return lambda: simulation.simulate_forest_market(area, harvest, density, years, demd=[500., -1e-6],
+                                                         supp=[0., 1e-6], dtype=dtype)
+    return setup
+
+
+case("simulation.simulate_forest_market")(_setup_simulate_forest_market(np.float64))
+case("simulation.simulate_forest_market[float32]")(_setup_simulate_forest_market(np.float32))
+
+
+@case("allocation_ras.ras_method")
+def _setup_ras_method(scale, workdir):
+    from . import allocation_ras
+    rng = np.random.default_rng(0)
+    n = _scaled(50, scale, 2)
+    products = rng.uniform(10, 100, n)
+    sources = rng.uniform(10, 100, n)
+    sources *= products.sum() / sources.sum()
+    return lambda: allocation_ras.ras_method(products, sources)
+
+
+@case("allocation_matrix.resolve_allocation_matrix")
+def _setup_resolve_allocation_matrix(scale, workdir):
+    from . import allocation_matrix
+    rng = np.random.default_rng(0)
+    n = _scaled(50, scale, 2)
+    sources = list(rng.uniform(10, 100, n))
+    product = list(rng.uniform(10, 100, n) * sum(sources) / (55. * n))
+    matrix = [list(row) for row in rng.uniform(0.1, 1., (n, n))]
+    # The default 1e4 iterations take minutes on a 50x50 table; 1e3 keeps the case comparable
+    return lambda: allocation_matrix.resolve_allocation_matrix(sources, product, matrix, 1e3)
+
+
+@case("market.market_equilibrium")
+def _setup_market_equilibrium(scale, workdir):
+    from . import market
+    rng = np.random.default_rng(0)
+    n = _scaled(30, scale) * 10
+    supp = np.column_stack([rng.uniform(0, 50, n), rng.uniform(0.5, 2, n), rng.uniform(0, 0.01, n)])
+    demd = np.column_stack([rng.uniform(300, 500, n), -rng.uniform(0.5, 2, n)])
+    return lambda: [market.market_equilibrium(s, d) for s, d in zip(supp, demd)]
+
+
+@case("market.market_equilibrium_batch")
+def _setup_market_equilibrium_batch(scale, workdir):
+    from . import market
+    rng = np.random.default_rng(0)
+    shape = (_scaled(30, scale), _scaled(100, scale), 10)
+    supp = np.stack([rng.uniform(0, 50, shape), rng.uniform(0.5, 2, shape), rng.uniform(0, 0.01, shape)], axis=-1)
+    demd = np.stack([rng.uniform(300, 500, shape), -rng.uniform(0.5, 2, shape)], axis=-1)
+    return lambda: market.market_equilibrium_batch(supp, demd)
+
+
+def measure(fn, repeat=3):
+    """
+    Measures a benchmark function.
+
+    Parameters:
+    fn (callable): Function without arguments.
+    repeat (int): Number of timed runs; the fastest is reported.
+
+    Returns:
+    dict: Best wall time in seconds ("time") and peak traced memory in bytes ("peak_memory"),
+          measured in a separate run so that tracing does not slow down the timed runs.
+    """
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"time": best, "peak_memory": peak}
+
+
+def run_suite(names=None, scale=1., repeat=3, workdir=None):
+    """
+    Runs the hot-path benchmark cases.
+
+    Parameters:
+    names (list of str, optional): Cases to run; all registered cases by default.
+    scale (float): Factor applied to the problem sizes, e.g. 0.1 for a quick run.
+    repeat (int): Number of timed runs per case.
+    workdir (str, optional): Directory for the synthetic input data; a temporary directory by default.
+
+    Returns:
+    dict: Mapping of case name to its measurement (see `measure`) and the scale.
+    """
+    names = list(CASES) if not names else names
+    own = workdir is None
+    workdir = tempfile.mkdtemp(prefix="dimark-bench-") if own else workdir
+    try:
+        results = {}
+        for name in names:
+            fn = CASES[name](scale, workdir)
+            results[name] = dict(measure(fn, repeat), scale=scale)
+        return results
+    finally:
+        if own:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compares benchmark results against a saved baseline.
+
+    Parameters:
+    results (dict): Results of `run_suite`.
+    baseline (dict): Results saved earlier with the same scale.
+    tolerance (float): Allowed relative increase of time and peak memory.
+
+    Returns:
+    list: Tuples (case, time ratio, memory ratio, regressed) for the cases present in both.
+    """
+    rows = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None or b.get("scale") != r["scale"]:
+            continue
+        time_ratio = r["time"] / b["time"] if b["time"] > 0 else float("inf")
+        memory_ratio = r["peak_memory"] / b["peak_memory"] if b["peak_memory"] > 0 else 1.
+        rows.append((name, time_ratio, memory_ratio,
+                     time_ratio > 1. + tolerance or memory_ratio > 1. + tolerance))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m DIMARK.benchmark", description="DIMARK benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("imports", help="import time of every module in a fresh interpreter")
+    p.add_argument("modules", nargs="*", default=MODULES)
+    p.add_argument("--repeat", type=int, default=5)
+    p = sub.add_parser("run", help="hot-path benchmark suite")
+    p.add_argument("cases", nargs="*", help="cases to run (default: all)")
+    p.add_argument("--scale", type=float, default=1., help="factor applied to the problem sizes")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--save", metavar="PATH", help="save the results as a baseline")
+    p.add_argument("--compare", metavar="PATH", help="compare the results against a saved baseline")
+    p.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    p.add_argument("--list", action="store_true", help="list the cases and exit")
+    args = parser.parse_args(argv)
+
+    if args.command == "imports":
+        for module, (t, heavy) in import_times(args.modules, args.repeat).items():
+            print(f"{module:20s} {t * 1e3:9.1f} ms   {', '.join(heavy)}")
+        return 0
+
+    if args.list:
+        print("\n".join(CASES))
+        return 0
+    unknown = [c for c in args.cases if c not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    results = run_suite(args.cases, args.scale, args.repeat)
+    for name, r in results.items():
+        print(f"{name:45s} {r['time'] * 1e3:10.1f} ms {r['peak_memory'] / 2**20:10.1f} MiB")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = False
+        for name, time_ratio, memory_ratio, bad in compare(results, baseline, args.tolerance):
+            print(f"{name:45s} time x{time_ratio:5.2f} memory x{memory_ratio:5.2f} {'REGRESSION' if bad else 'ok'}")
+            regressed = regressed or bad
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
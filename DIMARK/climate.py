@@ -1,7 +1,9 @@
 # DIMARK/climate.py
 
+import os
 import numpy as np
-import pandas as pd 
+from .intertemporal import area_step
+from .instrumentation import get_instrumentation
 
 def calculate_npp_coefficient(avg_temp, annual_precipitation, CO2_concentration, growing_season_length):
     """
@@ -15,6 +17,9 @@ def calculate_npp_coefficient(avg_temp, annual_precipitation, CO2_concentration,
     
     Returns:
     - float: Coefficient modifying net primary productivity (NPP) of biomass.
+    
+    The inputs may also be numpy arrays of any broadcastable shapes; the coefficient is then
+    computed elementwise.
     """
     
     # Weight coefficients for each parameter (can be adjusted based on empirical data)
@@ -44,6 +49,38 @@ def calculate_npp_coefficient(avg_temp, annual_precipitation, CO2_concentration,
 # 'ro' - matrix representing the average density of wood volume per hectare for species at specific ages
 # 'h' - matrix representing the shares of areas covered by species at specific ages that are harvested
 
+# Parsed NPP files, keyed by absolute path, modification time and size
+_NPP_CACHE = {}
+
+def load_NPP(file_path):
+    """
+    Parses the NPP CSV file once and returns its columns ending with 'dv' as a cached array.
+    
+    Parameters:
+    - file_path: The path to the NPP CSV file
+    
+    Returns:
+    - A tuple of the list of 'dv' column names and a read-only array of shape (rows, dv-columns)
+    
+    The file is parsed again only when its modification time or size changes.
+    """
+    stat = os.stat(file_path)
+    path = os.path.abspath(file_path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    cached = _NPP_CACHE.get(key)
+    if cached is None:
+        import pandas as pd
+
+        df = pd.read_csv(file_path)
+        dv_columns = [col for col in df.columns if col.endswith('dv')]
+        values = df[dv_columns].to_numpy(dtype=float)
+        values.setflags(write=False)
+        for k in [k for k in _NPP_CACHE if k[0] == path]:
+            del _NPP_CACHE[k]
+        cached = (dv_columns, values)
+        _NPP_CACHE[key] = cached
+    return cached
+
 def NPP_climate(file_path, c_NPP):
     """
     Reads the CSV file from the given path, multiplies values in columns ending with 'dv' by c_NPP,
@@ -56,15 +93,128 @@ def NPP_climate(file_path, c_NPP):
     Returns:
     - A DataFrame containing the processed columns
     """
-    # Read the CSV file
-    df = pd.read_csv(file_path)
+    import pandas as pd
+
+    # Columns ending with 'dv' of the cached file
+    dv_columns, values = load_NPP(file_path)
     
-    # Identify columns ending with 'dv'
-    dv_columns = [col for col in df.columns if col.endswith('dv')]
+    # Return the columns multiplied by c_NPP as a new DataFrame
+    return pd.DataFrame(values * c_NPP, columns=dv_columns)
+
+def NPP_climate_batch(file_path, c_NPP):
+    """
+    Multiplies the 'dv' columns of the NPP CSV file by a vector of NPP coefficients at once.
     
-    # Multiply the values in these columns by c_NPP
-    for col in dv_columns:
-        df[col] = df[col] * c_NPP
+    Parameters:
+    - file_path: The path to the NPP CSV file
+    - c_NPP: Array of NPP coefficients, e.g. one per climate scenario
     
-    # Return the filtered columns as a new DataFrame
-    return df[dv_columns]
\ No newline at end of file
+    Returns:
+    - An array of shape c_NPP.shape + (rows, dv-columns); for a vector of coefficients
+      (scenario x rows x dv-columns)
+    """
+    dv_columns, values = load_NPP(file_path)
+    c_NPP = np.asarray(c_NPP, dtype=float)
+    return c_NPP[..., None, None] * values
+
+
+def density_stack(density, c_NPP, dtype=np.float64):
+    """
+    Builds time-varying wood volume densities from yearly NPP coefficients.
+    
+    Parameters:
+    - density: Baseline density matrix (..., species, ages) of wood volume per hectare
+    - c_NPP: NPP coefficients of shape (years, ...); c_NPP[t] is broadcast against density[..., 0, 0]
+    - dtype: Precision of the returned stack (default float64)
+    
+    Returns:
+    - An array of shape (years, ..., species, ages) with the density of every projection year
+    
+    The yearly volume increments of the baseline density (differences between consecutive ages)
+    are scaled by the coefficient of the year in which they grow: a stand of age a in year t has
+    the volume of age a - 1 in year t - 1 plus the increment of age a times c_NPP[t]. The baseline
+    density is the density of the year before the projection, so coefficients equal to 1 reproduce it.
+    
+    With dtype=np.float32 every year is computed in float64 from the stored float32 densities of the
+    previous year, which are rounded once per year. After t years the error is at most t * 2**-24
+    times the largest density of the stack (6e-6 of it for 100 years).
+    """
+    density = np.asarray(density, dtype=float)
+    c_NPP = np.asarray(c_NPP, dtype=float)
+    dv = np.diff(density, axis=-1, prepend=0.)
+    shape = np.broadcast_shapes(c_NPP.shape[1:] + (1, 1), density.shape)
+    stack = np.empty((len(c_NPP),) + shape, dtype=dtype)
+    previous = density
+    for t in range(len(c_NPP)):
+        c = c_NPP[t][..., None, None]
+        stack[t, ..., 1:] = previous[..., :-1] + c * dv[..., 1:]
+        stack[t, ..., 0] = c[..., 0] * dv[..., 0]
+        previous = np.asarray(stack[t], dtype=float)
+    return stack
+
+def npp_density_stream(density, avg_temp, annual_precipitation, CO2_concentration, growing_season_length,
+                       chunk_size=16, dtype=np.float64):
+    """
+    Streams time-varying density stacks for gridded climate projections chunk by chunk.
+    
+    Parameters:
+    - density: Baseline density matrix (species, ages), or one per region (regions, species, ages)
+    - avg_temp, annual_precipitation, CO2_concentration, growing_season_length: Climate projections
+      broadcastable to (regions, years, scenarios); broadcasting does not copy them
+    - chunk_size: Number of (region, scenario) pairs per chunk
+    - dtype: Precision of the density stacks, see `density_stack`
+    
+    Yields:
+    - Tuples of region indices, scenario indices and the density stacks of these pairs, of shape
+      (years, chunk, species, ages)
+    
+    The NPP coefficients are computed only for the pairs of the current chunk, so at most one chunk
+    of coefficients and density stacks is held in memory.
+    """
+    climate = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in
+                                    (avg_temp, annual_precipitation, CO2_concentration, growing_season_length)])
+    if climate[0].ndim != 3:
+        raise ValueError("Climate projections must broadcast to (regions, years, scenarios).")
+    regions, years, scenarios = climate[0].shape
+    density = np.asarray(density, dtype=float)
+    for start in range(0, regions * scenarios, chunk_size):
+        r, s = np.unravel_index(np.arange(start, min(start + chunk_size, regions * scenarios)), (regions, scenarios))
+        c_NPP = calculate_npp_coefficient(*[v[r, :, s] for v in climate]).T
+        d = density[r] if density.ndim == 3 else density
+        yield r, s, density_stack(d, c_NPP, dtype)
+
+def climate_volume_projection(area_t0, harvest, density, avg_temp, annual_precipitation, CO2_concentration,
+                              growing_season_length, chunk_size=16, dtype=np.float64):
+    """
+    Projects areas and wood volumes under gridded climate projections chunk by chunk.
+    
+    Parameters:
+    - area_t0: Initial area matrix (species, ages), or one per region (regions, species, ages)
+    - harvest: A sequence of harvest matrices over the projection years, as in `intertemporal.area_prediction`
+    - density, avg_temp, annual_precipitation, CO2_concentration, growing_season_length, chunk_size:
+      See `npp_density_stream`
+    - dtype: Precision of the density stacks and of the area matrices carried from year to year; the
+      volumes are summed in float64 (default float64)
+    
+    Yields:
+    - Tuples of region indices, scenario indices, harvested volumes and standing volumes of these
+      (region, scenario) pairs, both of shape (years, chunk, species)
+    
+    The areas are advanced year by year, so apart from the density stack only the areas of one
+    year are held per chunk.
+    """
+    area_t0 = np.asarray(area_t0, dtype=float)
+    for r, s, stack in npp_density_stream(density, avg_temp, annual_precipitation, CO2_concentration,
+                                          growing_season_length, chunk_size, dtype):
+        get_instrumentation().count("climate.chunks")
+        years = len(stack)
+        area = area_t0[r] if area_t0.ndim == 3 else np.broadcast_to(area_t0, (len(r),) + area_t0.shape)
+        area = area.astype(dtype)
+        harvested = np.empty((years,) + area.shape[:-1])
+        standing = np.empty((years,) + area.shape[:-1])
+        for t in range(years):
+            standing[t] = np.sum(area * stack[t], axis=-1, dtype=np.float64)
+            next_area, harv_area = area_step(area, harvest[t])
+            harvested[t] = np.sum(harv_area * stack[t], axis=-1)
+            area = next_area.astype(dtype, copy=False)
+        yield r, s, harvested, standing
@@ -0,0 +1,238 @@
+# DIMARK/instrumentation.py
+
+# Runtime instrumentation of DIMARK. The package reports counters, timings, events and progress to
+# the active Instrumentation object, which by default does nothing. To collect metrics:
+#
+#     from DIMARK.instrumentation import MetricsRegistry, instrumented, tqdm_progress
+#     registry = MetricsRegistry(progress=tqdm_progress)
+#     with instrumented(registry):
+#         bdl.cultivation_area("SO", 1, 200, folder)
+#     registry.snapshot()
+#
+# The active instrumentation is a per-process global. In worker processes install a registry in the
+# worker, return `registry.snapshot()` with the results and combine the snapshots in the parent
+# with `MetricsRegistry.merge`.
+
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class _NullTimer:
+    """Context manager that does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Context manager reporting its elapsed time to an instrumentation."""
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        self.instrumentation.timing(self.name, self.seconds)
+        return False
+
+
+class Instrumentation:
+    """
+    Receiver of the runtime metrics of DIMARK; all methods do nothing.
+
+    Subclasses override `count`, `timing` and `event` to forward the metrics, e.g. to a job
+    metrics system. `progress` wraps the loops over forest districts.
+
+    Parameters:
+    progress (callable, optional): Function (iterable, desc, total) returning an iterable that
+                                   reports progress, e.g. `tqdm_progress`.
+    """
+
+    def __init__(self, progress=None):
+        self._progress = progress
+
+    def count(self, name, value=1):
+        """Adds value to the counter name."""
+
+    def timing(self, name, seconds):
+        """Records the duration of one run of the stage name."""
+
+    def event(self, name, **fields):
+        """Records a named event with its fields."""
+
+    def timer(self, name):
+        """Returns a context manager recording the duration of its block as a timing."""
+        return _Timer(self, name)
+
+    def progress(self, iterable, desc="", total=None):
+        """Wraps an iterable with the progress reporter, if any."""
+        if self._progress is None:
+            return iterable
+        return self._progress(iterable, desc=desc, total=total)
+
+
+class NullInstrumentation(Instrumentation):
+    """Default instrumentation: ignores all metrics with negligible overhead."""
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+
+class CallbackInstrumentation(Instrumentation):
+    """
+    Instrumentation forwarding the metrics to callbacks.
+
+    Parameters:
+    on_count (callable, optional): Called as on_count(name, value).
+    on_timing (callable, optional): Called as on_timing(name, seconds).
+    on_event (callable, optional): Called as on_event(name, fields).
+    progress (callable, optional): See `Instrumentation`.
+    """
+
+    def __init__(self, on_count=None, on_timing=None, on_event=None, progress=None):
+        super().__init__(progress)
+        self.on_count = on_count
+        self.on_timing = on_timing
+        self.on_event = on_event
+
+    def count(self, name, value=1):
+        if self.on_count is not None:
+            self.on_count(name, value)
+
+    def timing(self, name, seconds):
+        if self.on_timing is not None:
+            self.on_timing(name, seconds)
+
+    def event(self, name, **fields):
+        if self.on_event is not None:
+            self.on_event(name, fields)
+
+
+class MetricsRegistry(Instrumentation):
+    """
+    Thread-safe instrumentation accumulating counters, timings and recent events.
+
+    Parameters:
+    max_events (int): Number of most recent events kept (default is 1000).
+    progress (callable, optional): See `Instrumentation`.
+    """
+
+    def __init__(self, max_events=1000, progress=None):
+        super().__init__(progress)
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+        self.events = deque(maxlen=max_events)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timing(self, name, seconds):
+        with self._lock:
+            n, total, longest = self.timings.get(name, (0, 0., 0.))
+            self.timings[name] = (n + 1, total + seconds, max(longest, seconds))
+
+    def event(self, name, **fields):
+        with self._lock:
+            self.events.append((name, fields))
+
+    def rate(self, counter, timing):
+        """Counter value per second of the total time of a timing, e.g. rows parsed per second of reading."""
+        with self._lock:
+            seconds = self.timings.get(timing, (0, 0., 0.))[1]
+            return self.counters.get(counter, 0) / seconds if seconds > 0 else 0.
+
+    def snapshot(self):
+        """
+        Returns the accumulated metrics as plain, picklable data.
+
+        Returns:
+        dict: "counters" (name -> value), "timings" (name -> (runs, total seconds, longest run))
+              and "events" (list of (name, fields)).
+        """
+        with self._lock:
+            return {"counters": dict(self.counters), "timings": dict(self.timings), "events": list(self.events)}
+
+    def merge(self, snapshot):
+        """Adds the metrics of a snapshot, e.g. one returned by a worker process."""
+        with self._lock:
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, (n, total, longest) in snapshot["timings"].items():
+                n0, total0, longest0 = self.timings.get(name, (0, 0., 0.))
+                self.timings[name] = (n0 + n, total0 + total, max(longest0, longest))
+            self.events.extend(snapshot["events"])
+
+    def reset(self):
+        """Clears all metrics."""
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+            self.events.clear()
+
+
+def tqdm_progress(iterable, desc="", total=None):
+    """Progress reporter drawing a tqdm bar, as DIMARK did before instrumentation was pluggable."""
+    from tqdm import tqdm
+
+    return tqdm(iterable, desc=desc or "Progress", total=total, unit="dir", ncols=100)
+
+
+_current = NullInstrumentation()
+
+
+def get_instrumentation():
+    """Returns the active instrumentation of this process."""
+    return _current
+
+
+def set_instrumentation(instrumentation):
+    """
+    Sets the active instrumentation of this process.
+
+    Parameters:
+    instrumentation (Instrumentation or None): New instrumentation; None restores the no-op default.
+
+    Returns:
+    Instrumentation: The previously active instrumentation.
+    """
+    global _current
+    previous = _current
+    _current = NullInstrumentation() if instrumentation is None else instrumentation
+    return previous
+
+
+@contextmanager
+def instrumented(instrumentation):
+    """Context manager activating an instrumentation for the duration of its block."""
+    previous = set_instrumentation(instrumentation)
+    try:
+        yield instrumentation
+    finally:
+        set_instrumentation(previous)
+
+
+def timed(name):
+    """Decorator recording every call of the decorated function as a timing of the stage name."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _current.timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -1,5 +1,8 @@
 # DIMARK/intertemporal.py
 
+import numpy as np
+from .instrumentation import timed
+
 def Mmultiple(a, b):
     """Element-wise multiplication of two matrices."""
     return [[a[x][y] * b[x][y] for y in range(len(a[0]))] for x in range(len(a))]
@@ -18,6 +21,7 @@ def harvest_volume(a, h, ro):
 # We assume that a series of matrices 'ro' and 'h', along with an initial area matrix 'a', are given. 
 # The function will calculate the harvested wood volumes for each species over the years.
 
+@timed("intertemporal.area_prediction")
 def area_prediction(area_t0, harvest, time=100):
     """Predicts the area and harvested wood volumes over a specified time period.
     
@@ -80,6 +84,59 @@ def volume_prediction(t_area, density):
         t_volume.append(np.multiply(t_area[t], density))
     
     # Return the list of wood volume matrices
+    return t_volume
+
+
+def area_step(area, harvest):
+    """Advances area matrices by one year.
+
+    Parameters:
+    area (array-like): Area matrices for species at specific ages, shape (..., species, ages).
+    harvest (array-like): Harvest shares broadcastable against `area`.
+
+    Returns:
+    tuple: The area matrices of the next year and the harvested area matrices, both of shape (..., species, ages).
+
+    The update is the one of `area_prediction`: the harvested area is removed, the oldest age class
+    is merged into the one before it, every class ages by one year and the harvested area is replanted
+    at age zero.
+    """
+    area = np.asarray(area, dtype=float)
+    harv_area = area * harvest
+    remaining = area - harv_area
+    new_area = np.empty_like(remaining)
+    new_area[..., 1:] = remaining[..., :-1]
+    new_area[..., -1] += remaining[..., -1]
+    new_area[..., 0] = harv_area.sum(axis=-1)
+    return new_area, harv_area
 
 
-def 
\ No newline at end of file
+@timed("intertemporal.area_prediction_batch")
+def area_prediction_batch(area_t0, harvest, time=100, dtype=np.float64):
+    """Vectorized `area_prediction` for many scenarios at once.
+
+    Parameters:
+    area_t0 (array-like): Initial area matrices, shape (..., species, ages); the leading dimensions
+                          hold scenarios.
+    harvest (array-like): A sequence of harvest matrices over time; harvest[t] is broadcast against area_t0.
+    time (int): Number of years to simulate. Defaults to 100.
+    dtype (dtype): Precision of the returned arrays. Defaults to float64.
+
+    Returns:
+    tuple: Area matrices of shape (time + 1, ..., species, ages) and harvested areas of shape
+           (time, ..., species).
+
+    With dtype=np.float32 the outputs take half the memory. Every yearly step is still computed in
+    float64 from the stored float32 areas, so only the storage is rounded, once per year. As all
+    areas and harvest shares are non-negative, the relative error of every entry after t years is
+    at most (t + 1) * 2**-24, i.e. below 6.1e-6 for a 100-year projection, and the total area is
+    conserved to the same relative accuracy.
+    """
+    area = np.asarray(area_t0, dtype=float)
+    areas = np.empty((time + 1,) + area.shape, dtype=dtype)
+    harvested = np.empty((time,) + area.shape[:-1], dtype=dtype)
+    areas[0] = area
+    for t in range(time):
+        areas[t + 1], harv_area = area_step(areas[t], harvest[t])
+        harvested[t] = harv_area.sum(axis=-1)
+    return areas, harvested
@@ -1,7 +1,7 @@
 # DIMARK/market.py
 import numpy as np
-import statsmodels.api as sm
-from .mathematics import functionvalue, integrate_poly
+from .mathematics import Polynomial
+from .instrumentation import get_instrumentation, timed
 
 def market_equilibrium(supp, demd, maxdif=1.,maxiter=1e3):
     """
@@ -22,17 +22,19 @@ def market_equilibrium(supp, demd, maxdif=1.,maxiter=1e3):
         - number of iterations
     """
 
+    supply = Polynomial(supp)
+    demand = Polynomial(demd)
     delta = 1.
     q = [5.0]
     i=0
-    sup = functionvalue(supp, q, "poly")
-    dem = functionvalue(demd, q, "poly")
+    sup = supply(np.array(q))
+    dem = demand(np.array(q))
     
     while (np.abs(sup[0]-dem[0]) > maxdif) and (i<maxiter):
         i += 1
         q.append(q[0]+delta)
-        sup = functionvalue(supp, q, "poly")
-        dem = functionvalue(demd, q, "poly")
+        sup = supply(np.array(q))
+        dem = demand(np.array(q))
         dy = np.abs(sup[0]-dem[0])
         dy2 = np.abs(sup[1]-dem[1])
         if (dy2 < dy):
@@ -42,8 +44,198 @@ def market_equilibrium(supp, demd, maxdif=1.,maxiter=1e3):
         if (sup[0]-dem[0])*(sup[1]-dem[1]) < 0:
             delta = delta/2
 
+    get_instrumentation().count("market.market_equilibrium.iterations", i)
     return(q[0],(sup[0]+dem[0])*0.5,delta,np.abs(sup[0]-dem[0]),i)    
 
+
+# Status flags returned by market_equilibrium_batch for every pair of curves
+EQUILIBRIUM_FOUND = 0          # exactly one intersection in the quantity range
+EQUILIBRIUM_MULTIPLE = 1       # several intersections, the smallest stable one is returned
+EQUILIBRIUM_NONE = 2           # no intersection in the quantity range
+EQUILIBRIUM_NOT_CONVERGED = 3  # bracketed search did not reach the tolerance
+EQUILIBRIUM_COINCIDENT = 4     # identical curves: every quantity is an equilibrium, none is returned
+
+
+def _coefficient_batches(supp, demd):
+    """Pads supply and demand coefficient sets to a common degree and broadcasts their batch shapes."""
+    supp = np.atleast_1d(np.asarray(supp, dtype=float))
+    demd = np.atleast_1d(np.asarray(demd, dtype=float))
+    n = max(supp.shape[-1], demd.shape[-1])
+    supp = np.concatenate([supp, np.zeros(supp.shape[:-1] + (n - supp.shape[-1],))], axis=-1)
+    demd = np.concatenate([demd, np.zeros(demd.shape[:-1] + (n - demd.shape[-1],))], axis=-1)
+    batch_shape = np.broadcast_shapes(supp.shape[:-1], demd.shape[:-1])
+    return np.broadcast_to(supp, batch_shape + (n,)), np.broadcast_to(demd, batch_shape + (n,))
+
+
+# Relative distance within which computed roots are merged into one. A root of multiplicity k is
+# perturbed by about eps ** (1 / k) by the eigenvalue solver, i.e. 1.5e-8 for double and 6e-6 for
+# triple roots.
+_ROOT_CLUSTER = 1e-4
+
+
+def _real_roots(d, qmin=-np.inf, qmax=np.inf):
+    """
+    Distinct real roots in [qmin, qmax] of the polynomials d (one per row), sorted and padded with nan
+    to shape (rows, max(n - 1, 1)). Roots closer than _ROOT_CLUSTER are merged, so that a repeated root is
+    returned once; merged conjugate pairs become real.
+    """
+    m, n = d.shape
+    out = np.full((m, max(n - 1, 1)), np.nan)
+
+    # Effective degree of every polynomial (vanishing leading terms are dropped)
+    scale = np.abs(d).max(axis=1, keepdims=True)
+    nonzero = np.abs(d) > 1e-12 * scale
+    degree = np.where(nonzero.any(axis=1), n - 1 - np.argmax(nonzero[:, ::-1], axis=1), -1)
+
+    for deg in np.unique(degree):
+        if deg < 1:
+            continue  # constant polynomial: no roots, or zero everywhere
+        idx = np.flatnonzero(degree == deg)
+        k = len(idx)
+        c = d[idx, :deg + 1]
+        if deg == 1:
+            roots = (-c[:, 0] / c[:, 1])[:, None].astype(complex)
+        else:
+            # Eigenvalues of the companion matrices, solved for the whole group at once
+            companion = np.zeros((k, deg, deg))
+            companion[:, 1:, :-1] = np.eye(deg - 1)
+            companion[:, :, -1] = -c[:, :deg] / c[:, deg:]
+            roots = np.linalg.eigvals(companion)
+
+        # Clusters of neighbouring roots (in the order of their real parts) replaced by their means
+        roots = np.take_along_axis(roots, np.argsort(roots.real, axis=1), axis=1)
+        gap = np.abs(np.diff(roots, axis=1)) > _ROOT_CLUSTER * np.maximum(1., np.abs(roots[:, 1:]))
+        cluster = np.arange(k)[:, None] * deg + np.concatenate([np.zeros((k, 1), dtype=int),
+                                                                 np.cumsum(gap, axis=1)], axis=1)
+        size = np.bincount(cluster.ravel(), minlength=k * deg).reshape(k, deg)
+        real = np.bincount(cluster.ravel(), roots.real.ravel(), k * deg).reshape(k, deg) / np.maximum(size, 1)
+        imag = np.bincount(cluster.ravel(), roots.imag.ravel(), k * deg).reshape(k, deg) / np.maximum(size, 1)
+        valid = (size > 0) & (np.abs(imag) <= 1e-8 * np.maximum(1., np.abs(real))) & (real >= qmin) & (real <= qmax)
+        out[idx, :deg] = np.sort(np.where(valid, real, np.nan), axis=1)
+    return out
+
+
+def _equilibrium_roots(d, qmin, qmax):
+    """Intersections from the real roots of the difference polynomials d (one per row)."""
+    r = _real_roots(d, qmin, qmax)
+    valid = ~np.isnan(r)
+
+    # Prefer stable intersections, where supply crosses demand from below
+    slope = Polynomial(d[:, None, :]).derivative()(r)
+    stable = valid & (slope >= 0)
+    pick = np.where(stable.any(axis=1, keepdims=True), stable, valid)
+    found = pick.any(axis=1)
+    j = np.argmin(np.where(pick, r, np.inf), axis=1)
+
+    q = np.where(found, r[np.arange(len(r)), j], np.nan)
+    status = np.where(found, np.where(valid.sum(axis=1) > 1, EQUILIBRIUM_MULTIPLE, EQUILIBRIUM_FOUND),
+                      EQUILIBRIUM_NONE).astype(np.int8)
+    status[np.all(d == 0, axis=1)] = EQUILIBRIUM_COINCIDENT
+    return q, status
+
+
+def _equilibrium_bracket(d, qmin, qmax, maxiter, tol):
+    """
+    Intersections found by simultaneous bisection of the difference polynomials d on [qmin, qmax].
+
+    The range is split at the turning points of every difference polynomial (the real roots of its
+    derivative), so that d is monotonic on every piece and each piece holds at most one crossing.
+    All pieces that change sign are bisected at once.
+    """
+    m, n = d.shape
+    difference = Polynomial(d[:, None, :])
+    turning = _real_roots(d[:, 1:] * np.arange(1, n), qmin, qmax) if n > 2 else np.full((m, 1), np.nan)
+    edges = np.concatenate([np.full((m, 1), float(qmin)), turning, np.full((m, 1), float(qmax))], axis=1)
+    edges = np.where(np.isnan(edges), float(qmax), edges)
+    lo = edges[:, :-1]
+    hi = edges[:, 1:]
+    flo = difference(lo)
+    fhi = difference(hi)
+    bracketed = (flo * fhi <= 0) & ((hi > lo) | (np.arange(lo.shape[1]) == 0))
+    rising = fhi >= flo
+    for i in range(int(maxiter)):
+        mid = 0.5 * (lo + hi)
+        fmid = difference(mid)
+        left = flo * fmid <= 0
+        hi = np.where(left, mid, hi)
+        lo = np.where(left, lo, mid)
+        flo = np.where(left, flo, fmid)
+        if np.all((hi - lo <= tol * (1. + np.abs(mid))) | ~bracketed):
+            break
+    mid = 0.5 * (lo + hi)
+    converged = hi - lo <= tol * (1. + np.abs(mid))
+    roots = np.where(bracketed, mid, np.nan)
+
+    # Smallest stable crossing (supply rising through demand), otherwise the smallest crossing
+    stable = bracketed & rising
+    pick = np.where(stable.any(axis=1, keepdims=True), stable, bracketed)
+    found = pick.any(axis=1)
+    j = np.argmin(np.where(pick, roots, np.inf), axis=1)
+    rows = np.arange(m)
+    q = np.where(found, roots[rows, j], np.nan)
+
+    # A root at a turning point is bracketed by both neighbouring pieces; count it once. Near such a
+    # tangency the difference rounds to zero over a range of about sqrt(eps), hence the root clustering.
+    ordered = np.sort(roots, axis=1)
+    distinct = 1 + np.sum(np.diff(ordered, axis=1) > _ROOT_CLUSTER * np.maximum(1., np.abs(ordered[:, 1:])), axis=1)
+    status = np.where(~found, EQUILIBRIUM_NONE,
+                      np.where(~converged[rows, j], EQUILIBRIUM_NOT_CONVERGED,
+                               np.where(distinct > 1, EQUILIBRIUM_MULTIPLE, EQUILIBRIUM_FOUND))).astype(np.int8)
+    coincident = np.all(d == 0, axis=1)
+    q[coincident] = np.nan
+    status[coincident] = EQUILIBRIUM_COINCIDENT
+    return q, status
+
+
+@timed("market.market_equilibrium_batch")
+def market_equilibrium_batch(supp, demd, qmin=0., qmax=np.inf, method="roots", maxiter=200, tol=1e-12):
+    """
+    Finds the market equilibria of many pairs of supply and demand polynomials at once.
+
+    Parameters:
+    supp (array-like): Coefficients of the supply polynomials in increasing powers, shape (..., n).
+    demd (array-like): Coefficients of the demand polynomials in increasing powers, shape (..., m).
+                       The leading (batch) dimensions of supp and demd are broadcast against each other,
+                       e.g. one set of coefficients per year and scenario.
+    qmin (float): Lower bound of admissible equilibrium quantities (default is 0).
+    qmax (float): Upper bound of admissible equilibrium quantities (default is no bound).
+    method (str): "roots" solves for the real roots of the difference polynomial (analytically for
+                  linear curves, from the companion matrix eigenvalues otherwise); "bracket" bisects
+                  the difference polynomial on [qmin, qmax], which then must be finite.
+    maxiter (int): Maximum number of bisection steps of the "bracket" method.
+    tol (float): Relative quantity tolerance of the "bracket" method.
+
+    Returns:
+    tuple: A tuple of arrays with the broadcast batch shape (numpy scalars for a single pair of
+           curves) containing:
+        - quantity in equilibrium (nan where no single equilibrium was found)
+        - price in equilibrium
+        - status flag (EQUILIBRIUM_FOUND, EQUILIBRIUM_MULTIPLE, EQUILIBRIUM_NONE,
+          EQUILIBRIUM_NOT_CONVERGED, or EQUILIBRIUM_COINCIDENT for identical curves)
+
+    When the curves cross several times in [qmin, qmax] both methods return the smallest quantity at
+    which supply crosses demand from below (or the smallest crossing if there is no such one); a
+    repeated root counts as one intersection. The "bracket" method bisects every piece of [qmin, qmax]
+    between the turning points of the difference polynomial, so it finds all crossings; a tangency
+    that does not change the sign is found only if the difference vanishes at the turning point.
+    """
+    supp, demd = _coefficient_batches(supp, demd)
+    batch_shape = supp.shape[:-1]
+    d = (supp - demd).reshape(-1, supp.shape[-1])
+
+    if method == "roots":
+        q, status = _equilibrium_roots(d, qmin, qmax)
+    elif method == "bracket":
+        if not np.isfinite(qmax):
+            raise ValueError("The bracket method requires a finite qmax.")
+        q, status = _equilibrium_bracket(d, qmin, qmax, maxiter, tol)
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+    q = q.reshape(batch_shape)
+    p = np.reshape(Polynomial(supp)(q), batch_shape)
+    return q[()], p[()], status.reshape(batch_shape)[()]
+
 def surplus(a,equilibrium_q, equilibrium_p=0):
     """
     Computes the surplus by finding the difference between the area under the
@@ -57,13 +249,36 @@ def surplus(a,equilibrium_q, equilibrium_p=0):
     Returns:
     float: Surplus calculated as the absolute difference between the integral and the rectangle area.
     """
+    poly = Polynomial(a)
     if equilibrium_p == 0:
-        equilibrium_p = functionvalue(a, [equilibrium_q])[0]
+        equilibrium_p = poly(equilibrium_q)
     rectangle = equilibrium_p*equilibrium_q
-    integral = integrate_poly(a, 0, equilibrium_q)
+    integral = poly.antiderivative()(equilibrium_q)
     return np.abs(integral - rectangle)
 
 
+def surplus_batch(a, equilibrium_q, equilibrium_p=None):
+    """
+    Vectorized `surplus` for arrays of quantities, prices and coefficient sets.
+
+    Parameters:
+    a (array-like): Coefficients of the polynomials in increasing powers, shape (..., n); the leading
+                    dimensions are broadcast against the quantities.
+    equilibrium_q (array-like): Market equilibrium quantities.
+    equilibrium_p (array-like, optional): Equilibrium prices; evaluated from `a` when omitted.
+
+    Returns:
+    np.ndarray: Surpluses with the broadcast shape of the coefficient sets and quantities.
+    """
+    poly = Polynomial(a)
+    q = np.asarray(equilibrium_q, dtype=float)
+    if equilibrium_p is None:
+        equilibrium_p = poly(q)
+    integral = poly.antiderivative()(q)
+    return np.abs(integral - equilibrium_p * q)
+
+
+
 def estimate_price_elasticity_of_supply(Q, P):
     """
     Estimates the price elasticity of supply using the provided quantities and prices.
@@ -82,16 +297,16 @@ def estimate_price_elasticity_of_supply(Q, P):
     logP = np.log(P)
     
     # Add a constant term to the prices for regression
-    X = sm.add_constant(logP)
+    X = np.column_stack([np.ones(len(logP)), logP])
     
     # Perform an ordinary least squares (OLS) regression
-    model = sm.OLS(logQ, X).fit()
+    params = np.linalg.lstsq(X, logQ, rcond=None)[0]
     
     # Extract the elasticity of supply (slope of the regression line)
-    ES = model.params[1]
+    ES = params[1]
     
     # Calculate the constant term (intercept of the regression line)
-    A = np.power(np.e, model.params[0])
+    A = np.power(np.e, params[0])
 
     return ES, A
 
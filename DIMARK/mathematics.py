@@ -1,6 +1,72 @@
 # DIMARK/mathematics.py
 import numpy as np
-import statsmodels.api as sm
+
+class Polynomial:
+    """
+    Polynomial, or a batch of polynomials, evaluated with a vectorized Horner scheme.
+
+    Args:
+    - coefficients (array-like): Coefficients in ascending order of degree, shape (..., n + 1).
+      Leading dimensions hold a batch of coefficient sets, e.g. one per year and scenario.
+
+    Description:
+    Calling the object evaluates every polynomial of the batch at the x values broadcast against
+    the batch shape; `grid` evaluates every polynomial at every x value. The derivative and the
+    antiderivative are built once and cached on the object.
+    """
+
+    def __init__(self, coefficients):
+        self.coefficients = np.atleast_1d(np.asarray(coefficients, dtype=float))
+        self._derivative = None
+        self._antiderivative = None
+
+    @property
+    def degree(self):
+        """Degree of the polynomials (number of coefficients minus one)."""
+        return self.coefficients.shape[-1] - 1
+
+    @property
+    def batch_shape(self):
+        """Shape of the batch of coefficient sets."""
+        return self.coefficients.shape[:-1]
+
+    def __call__(self, x):
+        """Evaluates the polynomials at x, broadcasting x against the batch shape."""
+        c = self.coefficients
+        y = np.zeros(np.broadcast(c[..., 0], x).shape)
+        for k in range(c.shape[-1] - 1, -1, -1):
+            y = y * x + c[..., k]
+        return y
+
+    def grid(self, x):
+        """Evaluates every polynomial of the batch at every x; returns an array of shape batch_shape + x.shape."""
+        x = np.asarray(x, dtype=float)
+        c = self.coefficients.reshape(self.batch_shape + (1,) * x.ndim + (self.degree + 1,))
+        return Polynomial(c)(x)
+
+    def derivative(self):
+        """Returns the (cached) derivative as a Polynomial."""
+        if self._derivative is None:
+            c = self.coefficients
+            if c.shape[-1] == 1:
+                self._derivative = Polynomial(np.zeros_like(c))
+            else:
+                self._derivative = Polynomial(c[..., 1:] * np.arange(1, c.shape[-1]))
+        return self._derivative
+
+    def antiderivative(self):
+        """Returns the (cached) antiderivative vanishing at zero as a Polynomial."""
+        if self._antiderivative is None:
+            c = self.coefficients
+            b = np.concatenate([np.zeros(self.batch_shape + (1,)), c / np.arange(1, c.shape[-1] + 1)], axis=-1)
+            self._antiderivative = Polynomial(b)
+        return self._antiderivative
+
+    def integrate(self, x0, x1):
+        """Definite integrals of the polynomials over [x0, x1]."""
+        F = self.antiderivative()
+        return F(x1) - F(x0)
+
 
 def functionvalue(a, x, functiontype="poly"):
     """
@@ -19,17 +85,9 @@ def functionvalue(a, x, functiontype="poly"):
     It assumes `a` represents coefficients of a polynomial unless specified otherwise.
     For each `xi` in `x`, it calculates `yi` using the formula:
     yi = sum(coef * xi**power for power, coef in enumerate(a))
+    The evaluation is delegated to `Polynomial`.
     """
-    y = []
-    for k in range(len(x)):
-        xi = x[k]
-        yi = a[0]
-        xv=1.0
-        for i in range(1,len(a)):
-            xv = xv*xi
-            yi = yi + xv*a[i] 
-        y.append(yi)
-    return y
+    return Polynomial(a).grid(x).tolist()
 
 
     
@@ -43,23 +101,15 @@ def integrate_poly(a, x0, x1):
     - x1 (float): Upper bound of integration.
 
     Returns:
-    - float: Definite integral of the polynomial over [x0, x1].
+    - float: Definite integral of the polynomial over [x0, x1]; an array for array bounds.
 
     Description:
     This function computes the definite integral of a polynomial defined by its coefficients `a`
     over the interval [x0, x1]. The coefficients `a` are assumed to be in ascending order of degree.
-    It first adjusts the coefficients to account for integration, computes the values of the integrated
-    polynomial at `x0` and `x1` using `functionvalue`, and returns the difference between these two values.
+    It is a thin wrapper over `Polynomial.integrate`; callers integrating the same polynomial
+    repeatedly should keep a `Polynomial` object, which caches its antiderivative.
     """
-    b=[0]
-    for i in range(len(a)):
-        b.append(a[i])
-#    b = a.insert(0, 0)  # Insert a_0 = 0 to handle integration constant
-    for i in range(1, len(b)):
-        b[i] = b[i] / i  # Divide each coefficient by its degree to integrate
-
-    y = functionvalue(b, [x0, x1])  # Compute function values at x0 and x1
-    return y[1] - y[0]  # Return the difference to get the definite integral
+    return np.asarray(Polynomial(a).integrate(x0, x1))[()]
 
     
 
@@ -98,6 +148,61 @@ def estimate_poly(x, y, n):
 
     return coefficients, mse
 
+def estimate_poly_batch(x, Y, n, select_degree=False):
+    """
+    Estimate polynomial coefficients and MSEs for many series sharing one x grid.
+
+    Args:
+    - x (list or numpy array): Shared array of x-coordinates of length m.
+    - Y (2D array): Array of y-series of shape (series, m), one series per row.
+    - n (int): Degree of the polynomials to be fitted, or the maximum degree when `select_degree` is True.
+    - select_degree (bool, optional): Choose the degree (0..n) of every series by leave-one-out
+      cross-validation (default is False).
+
+    Returns:
+    - tuple: Coefficients of shape (series, n + 1) in ascending order of degree and the MSE of every fit.
+      With `select_degree` the chosen degrees are returned as a third element and the coefficients
+      above the chosen degree are zero.
+
+    Description:
+    The Vandermonde matrix of the shared grid is QR-factorized once and every series is fitted
+    from the same factorization, which gives the same least squares solution as `estimate_poly`.
+    The factors of the lower degrees are the leading columns of the same Q and R, so the
+    leave-one-out errors of all candidate degrees (from the hat matrix diagonal) need no refits.
+    """
+    x = np.asarray(x, dtype=float)
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    if Y.shape[1] != len(x):
+        raise ValueError("Series must have the same length as x.")
+    if len(x) <= n:
+        raise ValueError("The number of points must exceed the polynomial degree.")
+
+    A = np.vander(x, n + 1, increasing=True)
+    Q, R = np.linalg.qr(A)
+    QtY = Y @ Q
+
+    if not select_degree:
+        coefficients = np.linalg.solve(R, QtY.T).T
+        mse = np.mean((Y - coefficients @ A.T)**2, axis=1)
+        return coefficients, mse
+
+    # Leave-one-out errors of every degree: residual / (1 - leverage)
+    leverage = np.cumsum(Q**2, axis=1)
+    press = np.empty((n + 1, Y.shape[0]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(n + 1):
+            residuals = Y - QtY[:, :k + 1] @ Q[:, :k + 1].T
+            press[k] = np.mean((residuals / (1. - leverage[:, k]))**2, axis=1)
+    press = np.where(np.isfinite(press), press, np.inf)
+    degrees = np.argmin(press, axis=0)
+
+    coefficients = np.zeros((Y.shape[0], n + 1))
+    for k in np.unique(degrees):
+        rows = degrees == k
+        coefficients[rows, :k + 1] = np.linalg.solve(R[:k + 1, :k + 1], QtY[rows, :k + 1].T).T
+    mse = np.mean((Y - coefficients @ A.T)**2, axis=1)
+    return coefficients, mse, degrees
+
 def array_difference(a, b):
     """
     Compute the element-wise difference between two arrays.
@@ -133,20 +238,80 @@ def pearson_correlation(x, y):
     if len(x) != len(y):
         raise ValueError("Lists must have the same length.")
     
-    # Calculate mean of x and y
-    mean_x = np.mean(x)
-    mean_y = np.mean(y)
+    # Center x and y
+    dx = np.asarray(x, dtype=float) - np.mean(x)
+    dy = np.asarray(y, dtype=float) - np.mean(y)
     
     # Calculate numerator and denominators for Pearson correlation coefficient
-    numerator = sum((xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y))
-    denominator_x = np.sqrt(sum((xi - mean_x)**2 for xi in x))
-    denominator_y = np.sqrt(sum((yi - mean_y)**2 for yi in y))
+    numerator = np.dot(dx, dy)
+    denominator_x = np.sqrt(np.dot(dx, dx))
+    denominator_y = np.sqrt(np.dot(dy, dy))
     
     # Calculate Pearson correlation coefficient
     correlation_coefficient = numerator / (denominator_x * denominator_y)
         
     return correlation_coefficient
 
+def _standardize_rows(X):
+    """Centers every row (over the last axis) and scales it to unit norm; constant rows become nan."""
+    Z = X - X.mean(axis=-1, keepdims=True)
+    norms = np.sqrt(np.einsum('...i,...i->...', Z, Z))[..., None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Z /= norms
+    Z[np.broadcast_to(norms == 0, Z.shape)] = np.nan
+    return Z
+
+def correlation_matrix(X, chunk_size=None, out=None):
+    """
+    Calculate the Pearson correlation matrix of many series at once.
+    
+    Parameters:
+    X (2D array): Series of shape (series, observations), one series per row.
+    chunk_size (int, optional): Number of rows of the result computed at a time; bounds the memory
+                                of the intermediate products. By default all rows at once.
+    out (2D array, optional): Array of shape (series, series) to write the result into, e.g. a
+                              numpy memmap for very many series.
+    
+    Returns:
+    np.ndarray: Correlation matrix of shape (series, series); rows of constant series are nan.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    n = X.shape[0]
+    Z = _standardize_rows(X)
+    if out is None:
+        out = np.empty((n, n))
+    step = chunk_size or n
+    for i in range(0, n, step):
+        out[i:i + step] = np.clip(Z[i:i + step] @ Z.T, -1., 1.)
+    return out
+
+def rolling_correlation(X, window, chunk_size=None):
+    """
+    Calculate Pearson correlation matrices of many series over a rolling window.
+    
+    Parameters:
+    X (2D array): Series of shape (series, observations), one series per row.
+    window (int): Number of consecutive observations in every window.
+    chunk_size (int, optional): Number of windows processed at a time; bounds the memory of the
+                                intermediate products to series * chunk_size * window values.
+                                By default all windows at once.
+    
+    Returns:
+    np.ndarray: Correlation matrices of shape (observations - window + 1, series, series);
+                element [t] covers observations t .. t + window - 1.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    if window < 2 or window > X.shape[1]:
+        raise ValueError("Window size must be between 2 and the number of observations.")
+    windows = np.lib.stride_tricks.sliding_window_view(X, window, axis=1)
+    m = windows.shape[1]
+    out = np.empty((m, X.shape[0], X.shape[0]))
+    step = chunk_size or m
+    for t in range(0, m, step):
+        Z = _standardize_rows(windows[:, t:t + step, :].transpose(1, 0, 2))
+        out[t:t + step] = np.clip(Z @ Z.transpose(0, 2, 1), -1., 1.)
+    return out
+
 def smooth_array(a, window_size=3):
     """
     Smooths the array `a` using a moving average filter with the specified `window_size`.
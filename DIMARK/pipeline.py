@@ -0,0 +1,312 @@
+# DIMARK/pipeline.py
+
+# Batch runner for ingest -> project -> allocate -> market pipelines, e.g.
+#     python -m DIMARK.pipeline config.json --workers 4
+#
+# The pipeline is declared in a JSON file:
+#     {
+#       "cache_dir": ".dimark_cache",
+#       "stages": [
+#         {"name": "area", "op": "cultivation_area",
+#          "params": {"species": "SO", "agemin": 1, "agemax": 200, "folder": "/data/BDL"}},
+#         {"name": "projection", "op": "harvest_area_prediction", "inputs": ["area"],
+#          "params": {"harvest_age_min": 90, "harvest_age_max": 120, "time_projection": 50}},
+#         {"name": "allocation", "op": "ras_method", "inputs": ["projection"],
+#          "params": {"products": [0.6, 0.4], "sources": [0.7, 0.3], "density": 250}},
+#         {"name": "market", "op": "market", "inputs": ["projection"],
+#          "params": {"density": 250, "demd": [500, -0.00001]}}
+#       ],
+#       "scenarios": {"base": {}, "late_harvest": {"projection": {"harvest_age_min": 100}}}
+#     }
+#
+# Scenarios override the parameters of single stages. Every stage result is cached under a key
+# derived from its operation, its parameters, the keys of its inputs and, for parameters naming
+# files or folders, their sizes and modification times. A rerun therefore recomputes only the
+# stages whose inputs changed. Stages with the same key in every scenario (typically the ingest)
+# run once before the scenarios, which are then independent and run in parallel with --workers.
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Version of the cached artifact format; changing it invalidates all cached results
+CACHE_VERSION = 1
+
+# Parameters naming input files or folders, fingerprinted in the stage keys
+PATH_PARAMS = ("folder", "file_path")
+
+# Built-in operations: name -> function(inputs, **params) returning a dict of arrays
+OPS = {}
+
+
+def op(name):
+    """Registers a pipeline operation under the given name."""
+    def register(function):
+        OPS[name] = function
+        return function
+    return register
+
+
+@op("cultivation_area")
+def _cultivation_area(inputs, species, agemin, agemax, folder):
+    from .bdl import cultivation_area
+    return {"area": cultivation_area(species, agemin, agemax, folder)}
+
+
+@op("harvest_area_prediction")
+def _harvest_area_prediction(inputs, harvest_age_min, harvest_age_max, time_projection, curr_year=2022,
+                             dtype="float64"):
+    from .bdl import harvest_area_prediction_pure
+    years, harvest = harvest_area_prediction_pure(inputs[0]["area"], harvest_age_min, harvest_age_max,
+                                                  time_projection, curr_year, np.dtype(dtype))
+    return {"year": years, "harvest_area": harvest}
+
+
+@op("harvest_area_past")
+def _harvest_area_past(inputs, harvest_age_min, harvest_age_max, timeback_projection, curr_year=2022):
+    from .bdl import harvest_area_past_pure
+    years, harvest = harvest_area_past_pure(inputs[0]["area"], harvest_age_min, harvest_age_max,
+                                            timeback_projection, curr_year)
+    return {"year": years, "harvest_area": harvest}
+
+
+@op("age_area_prediction")
+def _age_area_prediction(inputs, harvest_age_min, harvest_age_max, years=100, dtype="float64"):
+    """With "dtype": "float32" the projection is stored and cached in single precision."""
+    from .bdl import age_area_prediction_pure
+    return {"age_area": age_area_prediction_pure(inputs[0]["area"], harvest_age_min, harvest_age_max, years,
+                                                 np.dtype(dtype))}
+
+
+@op("ras_method")
+def _ras_method(inputs, products, sources, density=1., tol=1e-5, max_iter=10000):
+    """Without inputs the matrix for the given sums; with a projection input the sums are shares
+    of every year's harvested volume (harvest_area * density) and one matrix per year is returned."""
+    from .allocation_ras import ras_method
+    products = np.asarray(products, dtype=float)
+    sources = np.asarray(sources, dtype=float)
+    if not inputs:
+        return {"matrix": ras_method(products, sources, tol=tol, max_iter=max_iter)}
+    volume = np.asarray(inputs[0]["harvest_area"], dtype=float) * density
+    shares = ras_method(products / products.sum(), sources / sources.sum(), tol=tol, max_iter=max_iter)
+    return {"volume": volume, "matrix": volume[:, None, None] * shares}
+
+
+@op("market")
+def _market(inputs, density=1., demd=None, supp=None, ES=None, A=None):
+    from .simulation import market_from_harvest
+    volume = np.asarray(inputs[0]["harvest_area"], dtype=float) * density
+    price, consumer, producer = market_from_harvest(volume, demd, supp, ES, A)
+    return {"volume": volume, "price": price, "consumer_surplus": consumer, "producer_surplus": producer}
+
+
+def resolve_op(name):
+    """Returns the operation registered under name, or imports it from a "module:function" path."""
+    if name in OPS:
+        return OPS[name]
+    if ":" not in name:
+        raise ValueError(f"Unknown operation: {name}")
+    module, function = name.split(":", 1)
+    return getattr(importlib.import_module(module), function)
+
+
+def _fingerprint(path):
+    """Sizes and modification times of a file or of all files below a folder."""
+    if os.path.isfile(path):
+        s = os.stat(path)
+        return [[os.path.basename(path), s.st_size, s.st_mtime_ns]]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for n in sorted(names):
+            s = os.stat(os.path.join(root, n))
+            files.append([os.path.relpath(os.path.join(root, n), path), s.st_size, s.st_mtime_ns])
+    return files
+
+
+def stage_key(op_name, params, input_keys):
+    """Cache key of a stage from its operation, parameters, input keys and input file fingerprints."""
+    files = {p: _fingerprint(params[p]) for p in PATH_PARAMS if p in params and os.path.exists(params[p])}
+    payload = json.dumps({"version": CACHE_VERSION, "op": op_name, "params": params,
+                          "inputs": input_keys, "files": files}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+
+def plan(config):
+    """
+    Resolves the stages of every scenario.
+
+    Parameters:
+    config (dict): Pipeline configuration (see the module description).
+
+    Returns:
+    dict: Mapping of scenario name to a list of (stage name, operation, parameters, input stage
+          names, cache key) in execution order.
+    """
+    stages = config["stages"]
+    scenarios = config.get("scenarios") or {"default": {}}
+    names = [s["name"] for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Stage names must be unique.")
+    for name, overrides in scenarios.items():
+        unknown = set(overrides) - set(names)
+        if unknown:
+            raise ValueError(f"Scenario {name} overrides unknown stages: {', '.join(sorted(unknown))}")
+    plans = {}
+    for name, overrides in scenarios.items():
+        keys = {}
+        steps = []
+        for s in stages:
+            inputs = s.get("inputs", [])
+            missing = [i for i in inputs if i not in keys]
+            if missing:
+                raise ValueError(f"Stage {s['name']} uses inputs not defined before it: {', '.join(missing)}")
+            params = dict(s.get("params", {}), **overrides.get(s["name"], {}))
+            keys[s["name"]] = stage_key(s["op"], params, [keys[i] for i in inputs])
+            steps.append((s["name"], s["op"], params, inputs, keys[s["name"]]))
+        plans[name] = steps
+    return plans
+
+
+def _artifact_path(cache_dir, stage, key):
+    return os.path.join(cache_dir, f"{stage}-{key}.npz")
+
+
+def _load(path):
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+
+def _save(path, result):
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, **{k: np.asarray(v) for k, v in result.items()})
+    os.replace(tmp, path)
+
+
+def run_stage(step, results, cache_dir, force=False):
+    """
+    Runs one stage, or loads its result from the cache.
+
+    Parameters:
+    step (tuple): Stage as returned by `plan`.
+    results (dict): Results of the stages run before, by stage name.
+    cache_dir (str): Directory of the cached artifacts.
+    force (bool): Recompute even if the result is cached.
+
+    Returns:
+    tuple: The stage result (dict of arrays) and a log record (stage, key, "cached" or "computed", seconds).
+    """
+    name, op_name, params, inputs, key = step
+    path = _artifact_path(cache_dir, name, key)
+    t = time.perf_counter()
+    if not force and os.path.exists(path):
+        return _load(path), (name, key, "cached", time.perf_counter() - t)
+    result = resolve_op(op_name)([results[i] for i in inputs], **params)
+    _save(path, result)
+    return result, (name, key, "computed", time.perf_counter() - t)
+
+
+def run_scenario(steps, cache_dir, force=False, done=()):
+    """
+    Runs the stages of one scenario.
+
+    Parameters:
+    steps (list): Stages of the scenario as returned by `plan`.
+    cache_dir (str): Directory of the cached artifacts.
+    force (bool): Recompute the stages whose keys are not in `done` even if they are cached.
+    done (collection): Keys of stages already computed in this run, loaded from the cache.
+
+    Returns:
+    tuple: Results by stage name and the list of log records.
+    """
+    results = {}
+    log = []
+    for step in steps:
+        results[step[0]], record = run_stage(step, results, cache_dir, force and step[4] not in done)
+        log.append(record)
+    return results, log
+
+
+def run_pipeline(config, workers=1, force=False):
+    """
+    Runs all scenarios of a pipeline.
+
+    Parameters:
+    config (dict): Pipeline configuration (see the module description).
+    workers (int): Number of worker processes for the independent scenarios.
+    force (bool): Recompute all stages, ignoring the cache.
+
+    Returns:
+    tuple: Results (scenario -> stage -> dict of arrays) and log records (scenario -> list of records).
+    """
+    cache_dir = config.get("cache_dir", ".dimark_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    plans = plan(config)
+
+    # Stages with the same key in every scenario run once, before the scenarios
+    shared = set.intersection(*[{s[4] for s in steps} for steps in plans.values()])
+    first = next(iter(plans.values()))
+    prefix = []
+    for step in first:
+        if step[4] not in shared:
+            break
+        prefix.append(step)
+    _, prefix_log = run_scenario(prefix, cache_dir, force)
+    done = {s[4] for s in prefix}
+
+    results, logs = {}, {}
+    if workers > 1 and len(plans) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {name: pool.submit(run_scenario, steps, cache_dir, force, done) for name, steps in plans.items()}
+            for name, future in futures.items():
+                results[name], logs[name] = future.result()
+    else:
+        for name, steps in plans.items():
+            results[name], logs[name] = run_scenario(steps, cache_dir, force, done)
+    for name in logs:
+        logs[name] = prefix_log + logs[name][len(prefix):]
+    return results, logs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m DIMARK.pipeline", description="Run a DIMARK pipeline")
+    parser.add_argument("config", help="JSON pipeline configuration")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for independent scenarios")
+    parser.add_argument("--force", action="store_true", help="recompute all stages, ignoring the cache")
+    parser.add_argument("--output", help="write the results of all scenarios to this JSON file")
+    parser.add_argument("--dry-run", action="store_true", help="print the stage keys without running")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(args.config))
+    config["cache_dir"] = os.path.join(base, config.get("cache_dir", ".dimark_cache"))
+
+    if args.dry_run:
+        for scenario, steps in plan(config).items():
+            for name, op_name, params, inputs, key in steps:
+                cached = os.path.exists(_artifact_path(config["cache_dir"], name, key))
+                print(f"{scenario:20s} {name:20s} {key} {'cached' if cached else 'pending'}")
+        return 0
+
+    results, logs = run_pipeline(config, args.workers, args.force)
+    for scenario, log in logs.items():
+        for name, key, status, seconds in log:
+            print(f"{scenario:20s} {name:20s} {status:9s} {seconds * 1e3:10.1f} ms")
+    if args.output:
+        out = {s: {stage: {k: np.asarray(v).tolist() for k, v in r.items()} for stage, r in res.items()}
+               for s, res in results.items()}
+        with open(args.output, "w") as f:
+            json.dump(out, f)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
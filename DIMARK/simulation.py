@@ -0,0 +1,108 @@
+# DIMARK/simulation.py
+
+# Coupled forest-market simulation. Harvested areas projected as in `intertemporal.area_prediction`
+# (or with `bdl.harvest_probability` shares for a single species) are turned into harvested timber
+# volumes, which are the quantity supplied to the market in every year. Prices and surpluses are then
+# solved for all years and scenarios at once, optionally feeding the price back into the harvest
+# intensity of the following year.
+
+import numpy as np
+from .instrumentation import timed
+from .intertemporal import area_step
+from .mathematics import Polynomial
+from .market import surplus_batch, estimate_price_based_on_price_elasticity_of_supply
+
+
+def _market_price(volume, demd, ES, A):
+    """Price of the supplied volume from the elasticity of supply if given, otherwise from the inverse demand curve."""
+    if ES is not None:
+        return estimate_price_based_on_price_elasticity_of_supply(volume, ES, A)
+    if demd is None:
+        raise ValueError("Either demand coefficients or the elasticity of supply (ES, A) must be given.")
+    return Polynomial(demd)(volume)
+
+
+def market_from_harvest(volume, demd=None, supp=None, ES=None, A=None):
+    """
+    Computes market prices and surpluses for harvested timber volumes.
+
+    Parameters:
+    volume (array-like): Harvested volumes supplied to the market, e.g. of shape (years, scenarios).
+    demd (array-like, optional): Coefficients of the inverse demand polynomial in increasing powers,
+                                 shape (..., n) broadcastable against `volume`.
+    supp (array-like, optional): Coefficients of the supply polynomial used for the producer surplus.
+    ES (float or array-like, optional): Price elasticity of supply; with `A` it sets the price of the volume.
+    A (float or array-like, optional): Constant term of the log-log supply regression.
+
+    Returns:
+    tuple: A tuple of arrays containing:
+        - market price of the harvested volume
+        - consumer surplus under the demand curve (nan when `demd` is not given)
+        - producer surplus above the supply curve (nan when `supp` is not given)
+    """
+    volume = np.asarray(volume, dtype=float)
+    price = _market_price(volume, demd, ES, A)
+    consumer = surplus_batch(demd, volume, price) if demd is not None else np.full(np.shape(price), np.nan)
+    producer = surplus_batch(supp, volume, price) if supp is not None else np.full(np.shape(price), np.nan)
+    return price, consumer, producer
+
+
+@timed("simulation.simulate_forest_market")
+def simulate_forest_market(area_t0, harvest, density, years, demd=None, supp=None, ES=None, A=None,
+                           price_feedback=0., reference_price=None, pooled=True, dtype=np.float64):
+    """
+    Simulates the forest age structure and the timber market together.
+
+    Parameters:
+    area_t0 (array-like): Initial area matrices, shape (..., species, ages); the leading dimensions hold scenarios.
+    harvest (array-like): A sequence of harvest share matrices over time; harvest[t] is broadcast against area_t0.
+    density (array-like): Average wood volume per hectare for species at specific ages, broadcastable against area_t0.
+    years (int): Number of years to simulate.
+    demd, supp, ES, A: Market description, see `market_from_harvest`. Their batch dimensions are broadcast
+                       against the volumes of shape (..., ) when pooled, or (..., species) otherwise.
+    price_feedback (float): Elasticity of the harvest intensity with respect to price. With a non-zero value
+                            the harvest shares of year t + 1 are multiplied by (p_t / reference_price) ** price_feedback
+                            and clipped to [0, 1]. Defaults to 0 (no feedback).
+    reference_price (float or array-like, optional): Price at which the harvest intensity is unchanged;
+                                                     defaults to the price of the first year.
+    pooled (bool): If True all species are sold on one market, otherwise every species has its own market.
+    dtype (dtype): Precision of the area matrices, see `intertemporal.area_prediction_batch`. Volumes are
+                   summed and the market is solved in float64 in either case. Defaults to float64.
+
+    Returns:
+    tuple: A tuple containing:
+        - area matrices, shape (years + 1, ..., species, ages)
+        - harvested volumes, shape (years, ...) or (years, ..., species) when not pooled
+        - prices, consumer surpluses and producer surpluses with the shape of the volumes
+    """
+    area_t0 = np.asarray(area_t0, dtype=float)
+    density = np.asarray(density, dtype=float)
+
+    # Yearly steps; only the area matrices are kept for all years, the harvested volumes are summed
+    # over ages in every step. Without feedback the market is solved once for all years at the end.
+    areas = np.empty((years + 1,) + area_t0.shape, dtype=dtype)
+    areas[0] = area_t0
+    volume = None
+    intensity = 1.
+    for t in range(years):
+        h = harvest[t] if price_feedback == 0 else np.clip(np.asarray(harvest[t], dtype=float) * intensity, 0., 1.)
+        areas[t + 1], harv_area = area_step(areas[t], h)
+        v = (harv_area * density).sum(axis=-1)
+        if pooled:
+            v = v.sum(axis=-1)
+        if volume is None:
+            volume = np.empty((years,) + v.shape)
+        volume[t] = v
+        if price_feedback == 0:
+            continue
+        p, _, _ = market_from_harvest(v, demd, None, ES, A)
+        if reference_price is None:
+            reference_price = p
+        ratio = np.where(reference_price > 0, np.maximum(p, 0.) / reference_price, 1.)
+        intensity = np.power(ratio, price_feedback)
+        if not pooled:
+            intensity = intensity[..., None]
+        elif np.ndim(intensity) > 0:
+            intensity = intensity[..., None, None]
+    price, consumer, producer = market_from_harvest(volume, demd, supp, ES, A)
+    return areas, volume, price, consumer, producer
@@ -0,0 +1,260 @@
+# DIMARK/stands.py
+
+# Stand-level (arodes) tables of the Forest Data Bank. The tree storey rows of f_storey_species.txt
+# are joined once with the stand areas of f_subarea.txt and kept as compact numpy columns sorted by
+# (district, arodes_int_num). The joined table of a district can be saved to disk and
+# reloaded, and the tables of many districts are concatenated into one, so that stand-level queries
+# and the species x age aggregates of bdl.cultivation_areaf run as vectorized lookups.
+
+import os
+
+import numpy as np
+from .bdl import list_directories, read_district
+
+# Number of age classes of the aggregates, as in bdl.py
+AGES = 200
+
+
+class StandTable:
+    """
+    Array-backed table of tree storey rows joined with their stand areas.
+
+    Every row is one species part of a stand: `district` (index into `districts`), `arodes`
+    (arodes_int_num), `sub_area` (stand area in ha), `part` (part_cd_act in tenths), `species`
+    (index into `species_codes`), `age` (species_age) and `volume`. Rows are sorted by
+    (district, arodes).
+    """
+
+    COLUMNS = ("district", "arodes", "sub_area", "part", "species", "age", "volume")
+
+    def __init__(self, district, arodes, sub_area, part, species, age, volume, species_codes, districts):
+        order = np.lexsort((arodes, district))
+        self.district = np.asarray(district, dtype=np.int32)[order]
+        self.arodes = np.asarray(arodes, dtype=np.int64)[order]
+        self.sub_area = np.asarray(sub_area, dtype=np.float64)[order]
+        self.part = np.asarray(part, dtype=np.float32)[order]
+        self.species = np.asarray(species, dtype=np.int16)[order]
+        self.age = np.asarray(age, dtype=np.int16)[order]
+        self.volume = np.asarray(volume, dtype=np.float64)[order]
+        self.species_codes = np.asarray(species_codes, dtype=str)
+        self.districts = np.asarray(districts, dtype=str)
+
+    def __len__(self):
+        return len(self.arodes)
+
+    @classmethod
+    def from_bdl(cls, folderBDL, folder=""):
+        """
+        Builds the table of one forest district from its BDL folder.
+
+        Parameters:
+        folderBDL (str): Name of the folder with BDL data.
+        folder (str): Directory containing the BDL folders.
+
+        Returns:
+        StandTable: Table of the tree storey rows of the district.
+        """
+        import pandas as pd
+
+        bdl_subarea, bdl_storey = read_district(folderBDL, folder)
+        trees = bdl_storey[bdl_storey.storey_cd.fillna("").astype(str).str.startswith("DRZEW")]
+
+        # Join with the stand areas through the sorted subarea keys
+        keys = bdl_subarea["arodes_int_num"].to_numpy(dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        areas = bdl_subarea["sub_area"].to_numpy(dtype=float)[order]
+        arodes = trees["arodes_int_num"].to_numpy(dtype=np.int64)
+        if len(keys):
+            position = np.minimum(np.searchsorted(keys, arodes), len(keys) - 1)
+            sub_area = np.where(keys[position] == arodes, areas[position], np.nan)
+        else:
+            sub_area = np.full(len(arodes), np.nan)
+
+        species_codes, species = np.unique(trees["species_cd"].fillna("").astype(str).to_numpy(), return_inverse=True)
+        part = pd.to_numeric(trees["part_cd_act"], errors="coerce").to_numpy(dtype=float)
+        age = trees["species_age"].fillna(0).to_numpy(dtype=np.int64)
+        volume = trees["volume"].fillna(0).to_numpy(dtype=float)
+        return cls(np.zeros(len(arodes)), arodes, sub_area, part, species, age, volume, species_codes, [folderBDL])
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        Concatenates the tables of several districts into one.
+
+        Parameters:
+        tables (list of StandTable): Tables to concatenate.
+
+        Returns:
+        StandTable: Table with the districts and species codes of all tables.
+        """
+        species_codes = np.unique(np.concatenate([t.species_codes for t in tables])) if tables else np.array([], str)
+        districts = np.concatenate([t.districts for t in tables]) if tables else np.array([], str)
+        offsets = np.cumsum([0] + [len(t.districts) for t in tables])
+        columns = {c: [] for c in cls.COLUMNS}
+        for t, offset in zip(tables, offsets):
+            for c in ("arodes", "sub_area", "part", "age", "volume"):
+                columns[c].append(getattr(t, c))
+            columns["district"].append(t.district.astype(np.int32) + offset)
+            columns["species"].append(np.searchsorted(species_codes, t.species_codes)[t.species])
+        columns = {c: np.concatenate(v) if v else np.array([]) for c, v in columns.items()}
+        return cls(species_codes=species_codes, districts=districts, **columns)
+
+    def save(self, path):
+        """Saves the table to a .npz file."""
+        np.savez(path, species_codes=self.species_codes, districts=self.districts,
+                 **{c: getattr(self, c) for c in self.COLUMNS})
+
+    @classmethod
+    def load(cls, path):
+        """Loads a table saved with `save`."""
+        with np.load(path) as data:
+            return cls(**{k: data[k] for k in data.files})
+
+    @property
+    def area(self):
+        """np.ndarray: Area of every row (stand area times the part share), as in bdl.cultivation_areaf."""
+        return self.sub_area * self.part * 0.1
+
+    def species_index(self, species):
+        """Indices of the species codes starting with the given code, as str.startswith in bdl.py."""
+        return np.flatnonzero(np.char.startswith(self.species_codes, species))
+
+    def select(self, species=None, agemin=None, agemax=None, district=None, positive_volume=True):
+        """
+        Boolean mask of the rows matching the criteria.
+
+        Parameters:
+        species (str, optional): Species code prefix.
+        agemin (int, optional): Minimum age (inclusive).
+        agemax (int, optional): Maximum age (exclusive).
+        district (str or int, optional): District folder name or index.
+        positive_volume (bool): Keep only rows with positive volume, as bdl.cultivation_areaf does.
+
+        Returns:
+        np.ndarray: Mask of the rows.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if species is not None:
+            mask &= np.isin(self.species, self.species_index(species))
+        if agemin is not None:
+            mask &= self.age >= agemin
+        if agemax is not None:
+            mask &= self.age < agemax
+        if district is not None:
+            d = district if isinstance(district, (int, np.integer)) else self.district_index(district)
+            lo, hi = np.searchsorted(self.district, [d, d + 1])
+            in_district = np.zeros(len(self), dtype=bool)
+            in_district[lo:hi] = True
+            mask &= in_district
+        if positive_volume:
+            mask &= self.volume > 0
+        return mask
+
+    def district_index(self, name):
+        """Index of the district with the given folder name."""
+        found = np.flatnonzero(self.districts == name)
+        if len(found) == 0:
+            raise ValueError(f"Unknown district: {name}")
+        return int(found[0])
+
+    def stand(self, arodes, district=0):
+        """
+        Rows of the given stands.
+
+        Parameters:
+        arodes (int or array-like): arodes_int_num of the stands.
+        district (int): District index of the stands.
+
+        Returns:
+        np.ndarray: Indices of the rows of the stands, found by binary search on the sorted keys.
+        """
+        lo, hi = np.searchsorted(self.district, [district, district + 1])
+        keys = self.arodes[lo:hi]
+        arodes = np.atleast_1d(arodes)
+        start = np.searchsorted(keys, arodes, side="left")
+        counts = np.searchsorted(keys, arodes, side="right") - start
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(start, counts).astype(np.int64) + offsets + lo
+
+    def age_area(self, species, agemin=0, agemax=AGES):
+        """
+        Cultivation area of a species by age, as bdl.cultivation_areaf summed over the districts of the table.
+
+        Parameters:
+        species (str): Species code prefix.
+        agemin (int): Minimum age (inclusive).
+        agemax (int): Maximum age (exclusive).
+
+        Returns:
+        np.ndarray: Array of length 200 with the cultivation area by age.
+        """
+        mask = self.select(species, agemin, min(agemax, AGES))
+        return np.bincount(self.age[mask], weights=np.nan_to_num(self.area[mask]), minlength=AGES)[:AGES]
+
+    def species_age_area(self, positive_volume=True):
+        """
+        Cultivation area by species and age.
+
+        Returns:
+        np.ndarray: Array of shape (len(species_codes), 200); rows follow `species_codes`.
+        """
+        mask = self.select(positive_volume=positive_volume) & (self.age >= 0) & (self.age < AGES)
+        index = self.species[mask].astype(np.int64) * AGES + self.age[mask]
+        total = np.bincount(index, weights=np.nan_to_num(self.area[mask]), minlength=len(self.species_codes) * AGES)
+        return total.reshape(len(self.species_codes), AGES)
+
+    def species_age_volume(self, positive_volume=True):
+        """
+        Timber volume by species and age.
+
+        Returns:
+        np.ndarray: Array of shape (len(species_codes), 200); rows follow `species_codes`.
+        """
+        mask = self.select(positive_volume=positive_volume) & (self.age >= 0) & (self.age < AGES)
+        index = self.species[mask].astype(np.int64) * AGES + self.age[mask]
+        total = np.bincount(index, weights=self.volume[mask], minlength=len(self.species_codes) * AGES)
+        return total.reshape(len(self.species_codes), AGES)
+
+
+def load_stand_table(folderBDL, folder="", cache_dir=None):
+    """
+    Returns the stand table of a district, joined once and cached on disk.
+
+    Parameters:
+    folderBDL (str): Name of the folder with BDL data.
+    folder (str): Directory containing the BDL folders.
+    cache_dir (str, optional): Directory of the saved tables; without it the table is not saved.
+                               A saved table is rebuilt when the BDL files are newer.
+
+    Returns:
+    StandTable: Table of the district.
+    """
+    if cache_dir is None:
+        return StandTable.from_bdl(folderBDL, folder)
+    source = os.path.join(folder, folderBDL)
+    path = os.path.join(cache_dir, folderBDL + ".stands.npz")
+    sources = [os.path.join(source, f) for f in ("f_subarea.txt", "f_storey_species.txt")]
+    if os.path.exists(path) and os.path.getmtime(path) >= max(os.path.getmtime(s) for s in sources):
+        return StandTable.load(path)
+    table = StandTable.from_bdl(folderBDL, folder)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    table.save(tmp)
+    os.replace(tmp, path)
+    return table
+
+
+def load_stand_tables(folder="", cache_dir=None):
+    """
+    Returns the stand table of all districts in a folder of BDL data.
+
+    Parameters:
+    folder (str): Directory containing the BDL folders.
+    cache_dir (str, optional): See `load_stand_table`.
+
+    Returns:
+    StandTable: Concatenated table of all districts.
+    """
+    flist = sorted(list_directories(folder + "/"))
+    return StandTable.concatenate([load_stand_table(f, folder, cache_dir) for f in flist])
@@ -1,7 +1,8 @@
 #DIMARK/statistics.py
 
-import pandas as pd
-import statsmodels.api as sm
+# pandas and statsmodels are imported inside the functions that use them; statsmodels is optional.
+
+import numpy as np
 
 
 def multivariate_regression(df, dependent_variable):
@@ -21,6 +22,15 @@ def multivariate_regression(df, dependent_variable):
     # Independent variables (X)
     X = df.drop(columns=[dependent_variable])
     
+    try:
+        import statsmodels.api as sm
+    except ImportError:
+        # Plain least squares when statsmodels is not installed
+        import pandas as pd
+        A = np.column_stack([np.ones(len(X)), X.to_numpy(dtype=float)])
+        coefficients = np.linalg.lstsq(A, Y.to_numpy(dtype=float), rcond=None)[0]
+        return pd.Series(coefficients, index=['const'] + list(X.columns))
+    
     # Add constant (intercept) to the independent variables
     X = sm.add_constant(X)
     
@@ -45,11 +55,208 @@ def test_durbin_watson(residuals):
            values < 2 indicate positive autocorrelation,
            and values > 2 indicate negative autocorrelation.
     """
-    mn = 0.0
-    lc = 0.0
-    for r in residuals:
-        mn += r * r
-    for i in range(1, len(residuals)):
-        lc += (residuals[i] - residuals[i - 1]) * (residuals[i] - residuals[i - 1])
+    residuals = np.asarray(residuals, dtype=float)
+    mn = np.dot(residuals, residuals)
+    lc = np.sum(np.diff(residuals)**2)
     dw_statistic = lc / mn
     return dw_statistic
+
+
+def grouped_regression(df, dependent_variable, group):
+    """
+    Performs one multivariate regression per group of a long DataFrame in batched linear algebra.
+
+    Parameters:
+    df (pd.DataFrame): The input DataFrame containing the data of all groups. Rows of every group
+                       are taken in their order in `df`, which matters for the Durbin-Watson statistic.
+    dependent_variable (str): The column name of the dependent variable.
+    group (str or list of str): Column name(s) identifying the groups, e.g. district and species.
+                                All remaining columns are the independent variables.
+
+    Returns:
+    tuple: Three DataFrames indexed by group:
+        - regression parameters (coefficients), with the 'const' intercept as in `multivariate_regression`
+        - standard errors of the parameters
+        - residual statistics: 'nobs', 'ssr', 'sigma2', 'r_squared' and 'durbin_watson'
+
+    Rows with a missing group key are dropped, as by `DataFrame.groupby`. Every group is reduced to its
+    means and centered cross products X'X, X'y and y'y (as in `RegressionAccumulator`), so the memory
+    grows with the number of rows and not with the size of the largest group.
+    """
+    import pandas as pd
+
+    group = [group] if isinstance(group, str) else list(group)
+    grouped = df.groupby(group, sort=True)
+    codes = grouped.ngroup().to_numpy(dtype=float)
+    index = grouped.size().index
+
+    # Rows sorted by group, keeping the original order within every group
+    keep = np.flatnonzero(~np.isnan(codes))
+    order = keep[np.argsort(codes[keep], kind='stable')]
+    codes = codes[order].astype(np.int64)
+    regressors = df.drop(columns=[dependent_variable] + group)
+    names = ['const'] + list(regressors.columns)
+    X = regressors.to_numpy(dtype=float)[order]
+    y = df[dependent_variable].to_numpy(dtype=float)[order]
+
+    # Per-group sums over the group-sorted rows
+    counts = np.bincount(codes, minlength=len(index))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    G, m = len(index), X.shape[1]
+    mean_x = np.add.reduceat(X, starts, axis=0) / counts[:, None] if m else np.zeros((G, 0))
+    mean_y = np.add.reduceat(y, starts) / counts
+    dx = X - mean_x[codes]
+    dy = y - mean_y[codes]
+    xtx = np.empty((G, m, m))
+    for i in range(m):
+        for j in range(i, m):
+            xtx[:, i, j] = xtx[:, j, i] = np.add.reduceat(dx[:, i] * dx[:, j], starts)
+    xty = np.add.reduceat(dx * dy[:, None], starts, axis=0) if m else np.zeros((G, 0))
+    yty = np.add.reduceat(dy * dy, starts)
+
+    # Batched solution of the centered normal equations; the pseudo-inverse keeps singular groups finite
+    inv = np.linalg.pinv(xtx, hermitian=True) if m else xtx
+    slopes = np.einsum('gij,gj->gi', inv, xty)
+    intercept = mean_y - np.einsum('gi,gi->g', mean_x, slopes)
+    params = np.column_stack([intercept, slopes])
+
+    # Residuals row by row, summed per group; the Durbin-Watson numerator skips group boundaries
+    residuals = dy - np.einsum('ni,ni->n', dx, slopes[codes])
+    ssr = np.add.reduceat(residuals**2, starts)
+    steps = np.diff(residuals)**2
+    steps[np.diff(codes) != 0] = 0.
+    dw_numerator = np.add.reduceat(np.concatenate([[0.], steps]), starts)
+
+    dof = counts - m - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma2 = np.where(dof > 0, ssr / dof, np.nan)
+        var_const = sigma2 * (1. / counts + np.einsum('gi,gij,gj->g', mean_x, inv, mean_x))
+        var_slopes = sigma2[:, None] * np.diagonal(inv, axis1=1, axis2=2)
+        bse = np.sqrt(np.column_stack([var_const, var_slopes]))
+        r_squared = 1. - ssr / yty
+        dw = dw_numerator / ssr
+
+    params = pd.DataFrame(params, index=index, columns=names)
+    bse = pd.DataFrame(bse, index=index, columns=names)
+    stats = pd.DataFrame({'nobs': counts, 'ssr': ssr, 'sigma2': sigma2,
+                          'r_squared': r_squared, 'durbin_watson': dw}, index=index)
+    return params, bse, stats
+
+
+class RegressionAccumulator:
+    """
+    Streaming multivariate regression estimated from sufficient statistics.
+
+    Chunks of data (e.g. one forest district at a time) are added with `update`; only the number of
+    observations, the means and the centered cross-product matrices X'X, X'y and y'y are kept, so the
+    data never has to be in memory at once. Accumulators filled by parallel workers are combined with
+    `merge`. The parameters and standard errors equal those of `multivariate_regression` on the pooled data.
+
+    Parameters:
+    dependent_variable (str): The column name of the dependent variable.
+    columns (list of str, optional): Names of the independent variables; by default all other
+                                     columns of the first chunk.
+    """
+
+    def __init__(self, dependent_variable, columns=None):
+        self.dependent_variable = dependent_variable
+        self.columns = None if columns is None else list(columns)
+        self.nobs = 0
+        self.mean_x = None
+        self.mean_y = 0.
+        self.xtx = None
+        self.xty = None
+        self.yty = 0.
+
+    def update(self, df):
+        """
+        Adds a chunk of observations.
+
+        Parameters:
+        df (pd.DataFrame): Chunk with the dependent variable and the independent variables.
+
+        Returns:
+        RegressionAccumulator: The accumulator itself.
+        """
+        if self.columns is None:
+            self.columns = [c for c in df.columns if c != self.dependent_variable]
+        x = df[self.columns].to_numpy(dtype=float)
+        y = df[self.dependent_variable].to_numpy(dtype=float)
+        if len(y) == 0:
+            return self
+        mx = x.mean(axis=0)
+        my = y.mean()
+        dx = x - mx
+        dy = y - my
+        self._combine(len(y), mx, my, dx.T @ dx, dx.T @ dy, dy @ dy)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the observations accumulated by another accumulator.
+
+        Parameters:
+        other (RegressionAccumulator): Accumulator over the same variables.
+
+        Returns:
+        RegressionAccumulator: The accumulator itself.
+        """
+        if other.nobs == 0:
+            return self
+        if self.columns is None:
+            self.columns = other.columns
+        elif other.columns != self.columns:
+            raise ValueError("Accumulators must have the same independent variables.")
+        self._combine(other.nobs, other.mean_x, other.mean_y, other.xtx, other.xty, other.yty)
+        return self
+
+    def _combine(self, n, mx, my, xtx, xty, yty):
+        """Pairwise update of the means and centered cross products (Chan et al.)."""
+        if self.nobs == 0:
+            self.nobs = n
+            self.mean_x = np.array(mx, dtype=float)
+            self.mean_y = float(my)
+            self.xtx = np.array(xtx, dtype=float)
+            self.xty = np.array(xty, dtype=float)
+            self.yty = float(yty)
+            return
+        total = self.nobs + n
+        delta_x = mx - self.mean_x
+        delta_y = my - self.mean_y
+        f = self.nobs * n / total
+        self.xtx += xtx + f * np.outer(delta_x, delta_x)
+        self.xty += xty + f * delta_x * delta_y
+        self.yty += yty + f * delta_y * delta_y
+        self.mean_x += delta_x * n / total
+        self.mean_y += delta_y * n / total
+        self.nobs = total
+
+    def _solve(self):
+        slopes = np.linalg.solve(self.xtx, self.xty)
+        intercept = self.mean_y - self.mean_x @ slopes
+        return intercept, slopes
+
+    @property
+    def params(self):
+        """pd.Series: Regression parameters, with the 'const' intercept as in `multivariate_regression`."""
+        import pandas as pd
+
+        intercept, slopes = self._solve()
+        return pd.Series(np.concatenate([[intercept], slopes]), index=['const'] + self.columns)
+
+    @property
+    def ssr(self):
+        """float: Sum of squared residuals."""
+        intercept, slopes = self._solve()
+        return max(self.yty - self.xty @ slopes, 0.)
+
+    @property
+    def bse(self):
+        """pd.Series: Standard errors of the regression parameters."""
+        import pandas as pd
+
+        sigma2 = self.ssr / (self.nobs - len(self.columns) - 1)
+        inv = np.linalg.inv(self.xtx)
+        var_const = sigma2 * (1. / self.nobs + self.mean_x @ inv @ self.mean_x)
+        var_slopes = sigma2 * np.diag(inv)
+        return pd.Series(np.sqrt(np.concatenate([[var_const], var_slopes])), index=['const'] + self.columns)
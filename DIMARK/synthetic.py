@@ -0,0 +1,129 @@
+# DIMARK/synthetic.py
+
+# Synthetic Forest Data Bank (BDL) datasets. The generated directory tree has the layout expected by
+# the functions in bdl.py (folders such as "BDL_01_01_NADL0001_2022" containing f_subarea.txt and
+# f_storey_species.txt with the same columns and codes), so that ingestion can be tested without
+# the real data and at any number of districts, e.g.
+#     python -m DIMARK.synthetic /tmp/bdl --districts 4000 --stands 5000 --seed 1
+
+import argparse
+import os
+
+import numpy as np
+
+# Species codes with their approximate share of the forest area in Poland
+SPECIES = {"SO": 0.58, "ŚW": 0.06, "JD": 0.03, "MD": 0.01, "DB": 0.08, "BK": 0.06,
+           "BRZ": 0.07, "OL": 0.05, "JS": 0.01, "GB": 0.02, "OS": 0.02, "LP": 0.01}
+
+# Number of regional directorates of the State Forests; districts are numbered within them
+REGIONS = 17
+
+# Storey codes of the rows that are not tree stands and are skipped by bdl.cultivation_areaf
+OTHER_STOREYS = ["PODR", "NAL", "POD"]
+
+
+def _stand_ages(rng, n):
+    """Ages of the main species: mostly managed even-aged stands with a thin tail of old stands."""
+    ages = rng.gamma(4.5, 13., n)
+    old = rng.random(n) < 0.05
+    ages[old] = rng.uniform(100., 180., old.sum())
+    return np.clip(np.round(ages), 1, 199).astype(int)
+
+
+def _volume_per_hectare(age, site):
+    """Chapman-Richards growth curve of the standing volume (m3/ha) scaled by the site productivity."""
+    return 450. * site * (1. - np.exp(-0.025 * age)) ** 2.5
+
+
+def generate_district(path, stands=2000, species=None, seed=0):
+    """
+    Writes the BDL files of one forest district.
+
+    :param path: Path of the district folder, created if needed (str)
+    :param stands: Number of stands (subareas) in the district (int)
+    :param species: Mapping of species code to its share of the stands (dict), SPECIES by default
+    :param seed: Seed of the random generator; the same seed always gives the same files (int or tuple)
+    :return: Number of rows written to f_storey_species.txt (int)
+    """
+    species = SPECIES if species is None else species
+    codes = np.array(list(species))
+    p = np.array(list(species.values()), dtype=float)
+    p /= p.sum()
+    rng = np.random.default_rng(seed)
+    os.makedirs(path, exist_ok=True)
+
+    ids = np.arange(1, stands + 1) * 10 + rng.integers(0, 10, stands)
+    sub_area = np.round(rng.lognormal(0.7, 0.7, stands), 2) + 0.01
+    site = rng.uniform(0.6, 1.3, stands)
+    age = _stand_ages(rng, stands)
+
+    # One to three species per stand with shares in tenths (part_cd_act) summing to 10
+    n_species = rng.choice([1, 2, 3], size=stands, p=[0.55, 0.3, 0.15])
+    rows = np.repeat(np.arange(stands), n_species)
+    position = np.arange(len(rows)) - np.repeat(np.cumsum(n_species) - n_species, n_species)
+    first_share = np.where(n_species == 1, 10, rng.integers(5, 9, stands))
+    share = np.where(position == 0, first_share[rows], 0)
+    rest = 10 - first_share
+    second = np.where(n_species == 3, rest - rest // 2, rest)
+    share = np.where(position == 1, second[rows], share)
+    share = np.where(position == 2, (rest // 2)[rows], share)
+    row_species = codes[rng.choice(len(codes), size=len(rows), p=p)]
+    row_age = np.where(position == 0, age[rows], np.clip(age[rows] + rng.integers(-15, 16, len(rows)), 1, 199))
+    volume = np.round(_volume_per_hectare(row_age, site[rows]) * sub_area[rows] * share / 10.)
+    volume[row_age < 10] = 0.
+
+    # Undergrowth and other storeys without volume
+    extra = rng.random(stands) < 0.2
+    extra_ids = ids[extra]
+    extra_storey = np.array(OTHER_STOREYS)[rng.integers(len(OTHER_STOREYS), size=len(extra_ids))]
+    extra_species = codes[rng.choice(len(codes), size=len(extra_ids), p=p)]
+    extra_age = rng.integers(1, 30, len(extra_ids))
+
+    with open(os.path.join(path, "f_subarea.txt"), "w", encoding="utf-8") as f:
+        f.write("arodes_int_num\tsub_area\n")
+        f.writelines(f"{i}\t{a:.2f}\n" for i, a in zip(ids, sub_area))
+    with open(os.path.join(path, "f_storey_species.txt"), "w", encoding="utf-8") as f:
+        f.write("arodes_int_num\tstorey_cd\tspecies_cd\tpart_cd\tpart_cd_act\tspecies_age\tvolume\n")
+        f.writelines(f"{i}\tDRZEW\t{s}\t{k}\t{k}\t{a}\t{v:.0f}\n"
+                     for i, s, k, a, v in zip(ids[rows], row_species, share, row_age, volume))
+        f.writelines(f"{i}\t{st}\t{s}\t\t\t{a}\t\n"
+                     for i, st, s, a in zip(extra_ids, extra_storey, extra_species, extra_age))
+    return len(rows) + len(extra_ids)
+
+
+def generate_bdl(folder, districts=400, stands=2000, species=None, year=2022, seed=0):
+    """
+    Writes a synthetic BDL directory tree with the given number of forest districts.
+
+    :param folder: Directory in which the district folders are created (str)
+    :param districts: Number of forest districts (int)
+    :param stands: Mean number of stands per district (int); district sizes vary by +-50%
+    :param species: Mapping of species code to its share of the stands (dict), SPECIES by default
+    :param year: Year in the folder names (int)
+    :param seed: Seed of the random generator; every district is generated from (seed, district number),
+                 so the same seed always gives the same data (int)
+    :return: List of the created district folder names (list)
+    """
+    sizes = np.random.default_rng(seed).integers(stands // 2, stands * 3 // 2 + 1, districts)
+    names = []
+    for d in range(districts):
+        name = f"BDL_{d % REGIONS + 1:02d}_{d // REGIONS + 1:02d}_NADL{d + 1:04d}_{year}"
+        generate_district(os.path.join(folder, name), max(int(sizes[d]), 1), species, (seed, d))
+        names.append(name)
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m DIMARK.synthetic", description="Synthetic BDL dataset")
+    parser.add_argument("folder")
+    parser.add_argument("--districts", type=int, default=400)
+    parser.add_argument("--stands", type=int, default=2000)
+    parser.add_argument("--year", type=int, default=2022)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    names = generate_bdl(args.folder, args.districts, args.stands, year=args.year, seed=args.seed)
+    print(f"{len(names)} districts written to {args.folder}")
+
+
+if __name__ == "__main__":
+    main()